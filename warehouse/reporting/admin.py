@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.models import User, Group
 from django.core.urlresolvers import reverse
 from django.utils.safestring import mark_safe
+from django.utils.html import format_html, format_html_join
 from django.db.models import Sum
 
 from reporting import models
@@ -17,7 +18,8 @@ class ReadOnlyAdmin(admin.ModelAdmin):
         else:
             return list(set(
                 [field.name for field in self.opts.local_fields] +
-                [field.name for field in self.opts.local_many_to_many]
+                [field.name for field in self.opts.local_many_to_many] +
+                list(self.readonly_fields)
             ))
 
 
@@ -37,6 +39,8 @@ class AssetAdmin(ReadOnlyAdmin):
     inlines = ShapeInline,
     fields = ('vs_id', 'username', 'filename', 'created', 'deleted',
             'raw_data', 'last_synced', 'last_sync', 'id', 'storage_size')
+    # Loaded from the payload table on the change page only
+    readonly_fields = ('raw_data', 'storage_size')
     list_display = ('vs_id', 'username', 'last_sync')
 
     #WARNING: Both of the below execute SQL for *each row* and are slow
@@ -54,6 +58,7 @@ class AssetAdmin(ReadOnlyAdmin):
 class ShapeAdmin(ReadOnlyAdmin):
     fields = ('vs_id', 'deleted', 'timestamp', 'last_synced', 'last_sync',
             'asset', 'version', 'raw_data', 'shapetag', 'size')
+    readonly_fields = ('raw_data',)
     list_display = ('vs_id', 'shapetag', 'size', 'version', 'asset',
             'last_sync')
     actions = None
@@ -71,19 +76,73 @@ class AssetInline(admin.TabularInline):
 
 
 class SyncRunAdmin(ReadOnlyAdmin):
-    list_display = ('sync_uuid', 'start_time', 'end_time', 'completed',
-            'remaining')
+    list_display = ('sync_uuid', 'site', 'start_time', 'end_time', 'completed',
+            'assets_per_second', 'deleted_assets', 'remaining')
+    fields = ('sync_uuid', 'site', 'start_time', 'end_time', 'completed',
+            'incremental', 'changed_since', 'high_water_mark', 'checkpoint',
+            'deleted_assets', 'deleted_shapes', 'assets_per_second',
+            'stage_timings', 'counters')
     actions = None
     #inlines = AssetInline,
 
     def remaining(self, obj):
         return obj.asset_set.count()
 
+    def assets_per_second(self, obj):
+        return obj.assets_per_second
+
+    assets_per_second.short_description = 'Assets/sec'
+
+    def stage_timings(self, obj):
+        rows = format_html_join('', '<tr><td>{0}</td><td>{1}</td><td>{2}s'
+                '</td><td>{3}s</td><td>{4}s</td></tr>',
+                ((stage, t['count'], '{:.3f}'.format(t['p50']),
+                  '{:.3f}'.format(t['p95']), '{:.1f}'.format(t['total']))
+                 for stage, t in obj.stage_timings()))
+        return format_html('<table><tr><th>Stage</th><th>Count</th>'
+                '<th>p50</th><th>p95</th><th>Total</th></tr>{0}</table>', rows)
+
+    def counters(self, obj):
+        counters = (obj.stats or {}).get('counters', {})
+        return ', '.join('{0}: {1}'.format(name, counters[name])
+                         for name in sorted(counters))
+
+
+class JobAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'kind', 'status', 'progress', 'created', 'finished',
+            'worker')
+    list_filter = ('kind', 'status')
+    actions = None
+
+
+class DailyStorageAdmin(ReadOnlyAdmin):
+    list_display = ('date', 'site', 'shapetag', 'username', 'bytes', 'shapes',
+            'assets', 'ingests')
+    list_filter = ('site', 'shapetag')
+    date_hierarchy = 'date'
+    actions = None
+
+
+class SiteSummaryAdmin(ReadOnlyAdmin):
+    list_display = ('site', 'assets', 'transcodes', 'size', 'uploaders',
+            'updated')
+    actions = None
+
+
+class AllSitesSummaryAdmin(ReadOnlyAdmin):
+    list_display = ('__unicode__', 'assets', 'transcodes', 'size', 'uploaders',
+            'updated')
+    actions = None
+
 
 admin.site.register(models.Asset, AssetAdmin)
 admin.site.register(models.Shape, ShapeAdmin)
 admin.site.register(models.Download)
 admin.site.register(models.SyncRun, SyncRunAdmin)
+admin.site.register(models.Job, JobAdmin)
+admin.site.register(models.DailyStorage, DailyStorageAdmin)
+admin.site.register(models.SiteSummary, SiteSummaryAdmin)
+admin.site.register(models.AllSitesSummary, AllSitesSummaryAdmin)
 admin.site.register(models.Site)
 
 #admin.site.unregister(User)
@@ -0,0 +1,342 @@
+"""Read-only JSON API for the frontend
+
+Lists are paged on the primary key rather than with ``OFFSET``: each page is
+the next ``limit`` rows with an id after the ``after`` parameter, and links to
+the following page in ``next``, so a page deep into a big table costs the same
+as the first. ``fields`` picks the fields returned, e.g.::
+
+    /api/assets/?site=trials.zonza.tv&fields=vs_id,username&limit=500
+
+The data only changes when a sync completes, so responses carry an ``ETag`` and
+``Last-Modified`` from the latest completed `SyncRun` (of the ``site`` asked
+for, if any) and clients and proxies can revalidate them cheaply.
+"""
+import hashlib
+import json
+from collections import OrderedDict
+from functools import wraps
+
+from dateutil import parser
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_GET
+
+from reporting.models import (AllSitesSummary, Asset, DailyStorage, Download,
+                              Shape, Site, SiteSummary, SyncRun)
+
+
+PAGE_SIZE = getattr(settings, 'API_PAGE_SIZE', 100)
+MAX_PAGE_SIZE = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+# Seconds clients and proxies may use a response without revalidating it
+MAX_AGE = getattr(settings, 'API_MAX_AGE', 60)
+
+
+class BadRequest(Exception):
+    pass
+
+
+class NotFound(Exception):
+    pass
+
+
+def _int(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest('Expected a number, not {0!r}'.format(value))
+
+
+def _date(value):
+    try:
+        return parser.parse(value)
+    except (ValueError, OverflowError):
+        raise BadRequest('Dates must be in the form YYYY-MM-DD')
+
+
+def _flag(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise BadRequest('Expected true or false, not {0!r}'.format(value))
+
+
+def _not_flag(value):
+    return not _flag(value)
+
+
+def select(request, fields):
+    """The ``(name, lookup)`` of the ``fields`` asked for, default all
+
+    :param fields:
+        An `OrderedDict` of the public name of each field to its lookup
+    """
+    if not request.GET.get('fields'):
+        return fields.items()
+    names = [name.strip() for name in request.GET['fields'].split(',')
+             if name.strip()]
+    unknown = [name for name in names if name not in fields]
+    if unknown:
+        raise BadRequest('Unknown fields {0}, choose from {1}'.format(
+            ', '.join(unknown), ', '.join(fields)))
+    return [(name, fields[name]) for name in names]
+
+
+def filtered(request, rows, filters):
+    """Apply the ``filters`` given in the query string to ``rows``
+
+    :param filters:
+        A dict of query parameter to ``(lookup, parse)``
+    """
+    for param, (lookup, parse) in filters.items():
+        if request.GET.get(param):
+            rows = rows.filter(**{lookup: parse(request.GET[param])})
+    return rows
+
+
+class Resource(object):
+    """A list of rows of ``model``, paged on its primary key
+
+    :param fields:
+        An `OrderedDict` of public field names to model lookups
+    :param filters:
+        A dict of query parameters to ``(lookup, parse)``
+    """
+
+    def __init__(self, model, fields, filters):
+        self.model = model
+        self.fields = fields
+        self.filters = filters
+
+    def page(self, request):
+        limit = min(max(_int(request.GET.get('limit', PAGE_SIZE)), 1),
+                    MAX_PAGE_SIZE)
+        fields = select(request, self.fields)
+
+        rows = filtered(request, self.model._default_manager.all(),
+                        self.filters)
+        if request.GET.get('after'):
+            rows = rows.filter(pk__gt=_int(request.GET['after']))
+        # One more than asked for, to tell if there's another page
+        lookups = ['pk'] + [lookup for name, lookup in fields]
+        rows = list(rows.order_by('pk').values(*lookups)[:limit + 1])
+
+        next_page = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            params = request.GET.copy()
+            params['after'] = rows[-1]['pk']
+            next_page = request.build_absolute_uri('{0}?{1}'.format(
+                request.path, params.urlencode()))
+
+        return {
+            'results': [OrderedDict((name, row[lookup])
+                                    for name, lookup in fields)
+                        for row in rows],
+            'next': next_page,
+        }
+
+
+def last_sync(request):
+    """``(pk, end_time)`` of the latest completed sync the response depends on"""
+    if not hasattr(request, '_api_last_sync'):
+        runs = SyncRun.objects.filter(completed=True)
+        if request.GET.get('site'):
+            runs = runs.filter(site__domain=request.GET['site'])
+        request._api_last_sync = runs.order_by('-end_time', '-pk') \
+                                     .values_list('pk', 'end_time').first()
+    return request._api_last_sync
+
+
+def etag(request, *args, **kwargs):
+    sync = last_sync(request)
+    if sync is None:
+        return None
+    return hashlib.sha1('{0}:{1}:{2}'.format(
+        sync[0], sync[1], request.get_full_path())).hexdigest()
+
+
+def last_modified(request, *args, **kwargs):
+    sync = last_sync(request)
+    if sync is None or sync[1] is None:
+        return None
+    modified = sync[1]
+    if timezone.is_naive(modified):
+        modified = timezone.make_aware(modified,
+                                       timezone.get_current_timezone())
+    return modified
+
+
+def json_response(data, status=200):
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder),
+                        content_type='application/json', status=status)
+
+
+def api_view(func):
+    """Serve what ``func`` returns as JSON, revalidated against the last sync
+
+    ``func`` raises `BadRequest` for bad query parameters and `NotFound` when
+    they name something that doesn't exist.
+    """
+    @wraps(func)
+    def view(request, *args, **kwargs):
+        try:
+            data = func(request, *args, **kwargs)
+        except BadRequest as exc:
+            return json_response({'error': unicode(exc)}, status=400)
+        except NotFound as exc:
+            return json_response({'error': unicode(exc)}, status=404)
+        return json_response(data)
+
+    conditional = require_GET(condition(etag_func=etag,
+                                        last_modified_func=last_modified)(view))
+
+    @wraps(func)
+    def cached(request, *args, **kwargs):
+        response = conditional(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            patch_cache_control(response, public=True, max_age=MAX_AGE)
+        return response
+    return cached
+
+
+SITES = Resource(Site, OrderedDict([
+    ('id', 'id'),
+    ('domain', 'domain'),
+    ('assets', 'summary__assets'),
+    ('transcodes', 'summary__transcodes'),
+    ('size', 'summary__size'),
+    ('uploaders', 'summary__uploaders'),
+    ('updated', 'summary__updated'),
+]), {
+    'site': ('domain', unicode),
+})
+
+ASSETS = Resource(Asset, OrderedDict([
+    ('id', 'id'),
+    ('vs_id', 'vs_id'),
+    ('filename', 'filename'),
+    ('username', 'username'),
+    ('created', 'created'),
+    ('deleted', 'deleted'),
+    ('last_synced', 'last_synced'),
+]), {
+    'site': ('sites__domain', unicode),
+    'username': ('username', unicode),
+    'deleted': ('deleted__isnull', _not_flag),
+    'created_after': ('created__gte', _date),
+    'created_before': ('created__lt', _date),
+})
+
+SHAPES = Resource(Shape, OrderedDict([
+    ('id', 'id'),
+    ('vs_id', 'vs_id'),
+    ('asset', 'asset'),
+    ('shapetag', 'shapetag'),
+    ('size', 'size'),
+    ('version', 'version'),
+    ('timestamp', 'timestamp'),
+    ('deleted', 'deleted'),
+]), {
+    'site': ('asset__sites__domain', unicode),
+    'asset': ('asset', _int),
+    'shapetag': ('shapetag', unicode),
+    'deleted': ('deleted__isnull', _not_flag),
+})
+
+DOWNLOADS = Resource(Download, OrderedDict([
+    ('id', 'id'),
+    ('item', 'item'),
+    ('shape', 'shape'),
+    ('username', 'username'),
+    ('when', 'when'),
+]), {
+    'site': ('item__sites__domain', unicode),
+    'username': ('username', unicode),
+    'when_after': ('when__gte', _date),
+    'when_before': ('when__lt', _date),
+})
+
+STORAGE_FIELDS = OrderedDict((name, name) for name in
+                             ('date',) + DailyStorage.TOTALS)
+STORAGE_FILTERS = {
+    'site': ('site__domain', unicode),
+    'shapetag': ('shapetag', unicode),
+    'username': ('username', unicode),
+}
+# Counted per shape tag in `DailyStorage`, so only totalled over one tag
+ASSET_COUNTS = ('assets', 'ingests')
+TOTALS_FIELDS = OrderedDict((name, name) for name in SiteSummary.TOTALS)
+
+
+@api_view
+def sites(request):
+    """Sites with their `SiteSummary` totals"""
+    SiteSummary.for_sites(Site.objects.filter(summary__isnull=True))
+    return SITES.page(request)
+
+
+@api_view
+def assets(request):
+    return ASSETS.page(request)
+
+
+@api_view
+def shapes(request):
+    return SHAPES.page(request)
+
+
+@api_view
+def downloads(request):
+    return DOWNLOADS.page(request)
+
+
+@api_view
+def storage(request):
+    """Daily totals from the `DailyStorage` rollup, between ``start`` and
+    ``end``
+
+    Without a ``shapetag`` the ``assets`` and ``ingests`` are those of the
+    original shapes, as counting every tag counts an asset once for each.
+    """
+    fields = select(request, STORAGE_FIELDS)
+    start, end = [_date(request.GET[param]).date()
+                  if request.GET.get(param) else None
+                  for param in ('start', 'end')]
+    filters = dict((lookup, parse(request.GET[param]))
+                   for param, (lookup, parse) in STORAGE_FILTERS.items()
+                   if request.GET.get(param))
+    rows = DailyStorage.series(start, end, **filters)
+    if 'shapetag' not in filters and any(name in ASSET_COUNTS
+                                         for name, lookup in fields):
+        filters['shapetag'] = 'original'
+        originals = dict((row['date'], row) for row in
+                         DailyStorage.series(start, end, **filters))
+        for row in rows:
+            original = originals.get(row['date'], {})
+            for name in ASSET_COUNTS:
+                row[name] = original.get(name) or 0
+    return {
+        'results': [OrderedDict((name, row[name]) for name, lookup in fields)
+                    for row in rows],
+    }
+
+
+@api_view
+def totals(request):
+    """Totals over every site (or just ``site``), as on the dashboard"""
+    fields = select(request, TOTALS_FIELDS)
+    if request.GET.get('site'):
+        sites = SiteSummary.for_sites(
+            Site.objects.filter(domain=request.GET['site']))
+        if not sites:
+            raise NotFound('No such site')
+        summary = sites[0]
+    else:
+        summary = AllSitesSummary.current()
+    return OrderedDict((name, getattr(summary, name))
+                       for name, lookup in fields)
@@ -0,0 +1,185 @@
+"""A local stand-in for the Bork API, for benchmarking the sync offline
+
+Serves the endpoints the sync uses with generated data:
+
+``item?zonza_site=...&__page=N&__page_size=M``
+    Search results, as used by `perform_search`
+``item/<id>``
+    An asset, as used by `get_asset`
+``item/<id>/asset``
+    The asset's shapes, as used by `get_shapes_for_asset`
+``item/<id>/asset/<shape id>``
+    A shape, as used by `get_shape`
+"""
+import json
+import random
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+from reporting.models import PAGE_TOKEN, LIMIT_TOKEN
+
+
+class FakeBorkHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+    # Send the headers and body of a response in one write. Separate small
+    # writes on a kept-alive connection stall ~40ms on Nagle's algorithm and
+    # delayed ACKs, which would be timed as API latency
+    wbufsize = -1
+
+    def do_GET(self):
+        bork = self.server.bork
+        bork.count_request()
+        if bork.latency:
+            time.sleep(bork.latency)
+
+        roll = random.random()
+        if roll < bork.error_rate:
+            return self.respond(500, {'error': 'Injected error'})
+        if roll < bork.error_rate + bork.throttle_rate:
+            return self.respond(429, {'error': 'Injected throttle'},
+                                {'Retry-After': '1'})
+
+        url = urlparse.urlsplit(self.path)
+        parts = [part for part in url.path.split('/') if part][1:]  # No version
+        query = dict(urlparse.parse_qsl(url.query))
+        if parts == ['item']:
+            return self.respond(200, bork.search(query))
+        if len(parts) == 2 and parts[0] == 'item':
+            return self.respond_item(bork.asset(parts[1]))
+        if len(parts) == 3 and parts[0] == 'item' and parts[2] == 'asset':
+            return self.respond(200, bork.shapes(parts[1]))
+        if len(parts) == 4 and parts[0] == 'item' and parts[2] == 'asset':
+            return self.respond_item(bork.shape(parts[1], parts[3]))
+        self.respond(404, {'error': 'Not found'})
+
+    def respond_item(self, data):
+        if data is None:
+            return self.respond(404, {'error': 'Not found'})
+        etag = '"{0}"'.format(hash(json.dumps(data, sort_keys=True)))
+        if self.server.bork.etags:
+            if self.headers.get('If-None-Match') == etag:
+                return self.respond(304)
+            return self.respond(200, data, {'ETag': etag})
+        self.respond(200, data)
+
+    def respond(self, status, data=None, headers=None):
+        body = json.dumps(data) if data is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeBork(object):
+    """Generated Bork data served over HTTP on localhost
+
+    :param items: Number of assets in the site
+    :param shapes: Shapes per asset
+    :param latency: Seconds added to every response
+    :param error_rate: Fraction of requests answered with a 500
+    :param throttle_rate: Fraction of requests answered with a 429
+    :param etags: Send ETags and answer conditional requests with 304s
+    """
+
+    def __init__(self, site, items=1000, shapes=3, latency=0, error_rate=0,
+                 throttle_rate=0, etags=False):
+        self.site = site
+        self.items = items
+        self.shapes_per_item = shapes
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.etags = etags
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBorkHandler)
+        self.server.bork = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return 'http://{0}:{1}/v0/'.format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='fake-bork')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def asset_id(self, num):
+        return 'BA-{0}'.format(num)
+
+    def parse_id(self, vs_id, prefix):
+        try:
+            num = int(vs_id[len(prefix):])
+        except ValueError:
+            return None
+        if vs_id.startswith(prefix) and 0 <= num < self.items:
+            return num
+        return None
+
+    def search(self, query):
+        if query.get('zonza_site') != self.site:
+            return {'hits': 0, 'item': []}
+        size = int(query.get(LIMIT_TOKEN, 100))
+        start = (int(query.get(PAGE_TOKEN, 1)) - 1) * size
+        return {
+            'hits': self.items,
+            'item': [{'id': self.asset_id(num),
+                      'url': '{0}item/{1}'.format(self.url, self.asset_id(num))}
+                     for num in range(start, min(start + size, self.items))],
+        }
+
+    def asset(self, vs_id):
+        num = self.parse_id(vs_id, 'BA-')
+        if num is None:
+            return None
+        return {
+            'id': vs_id,
+            'metadata': {
+                'user': 'user{0}'.format(num % 50),
+                'zonza_site': self.site,
+                'title': 'Benchmark asset {0}'.format(num),
+            },
+        }
+
+    def shapes(self, vs_id):
+        num = self.parse_id(vs_id, 'BA-')
+        if num is None:
+            return {'assets': []}
+        tags = ['original'] + ['lowres{0}'.format(n)
+                               for n in range(1, self.shapes_per_item)]
+        return {'assets': [
+            {'tag': tag,
+             'asset': '{0}item/{1}/asset/BS-{2}'.format(
+                 self.url, vs_id, num * self.shapes_per_item + index)}
+            for index, tag in enumerate(tags[:self.shapes_per_item])]}
+
+    def shape(self, vs_id, shape_id):
+        if self.parse_id(vs_id, 'BA-') is None:
+            return None
+        return {'id': shape_id, 'size': 1024 * 1024 * (len(shape_id) + 1)}
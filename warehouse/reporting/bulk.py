@@ -0,0 +1,174 @@
+"""Set-based writes used by the sync
+
+Rows are plain dicts keyed by field ``attname`` (e.g. ``last_sync_id``) with
+python values. Writes use ``INSERT ... ON CONFLICT``, so need Postgres 9.5+.
+"""
+import logging
+
+from django.db import connection
+
+from reporting.models import Asset, AssetPayload, Shape, ShapePayload
+
+
+log = logging.getLogger(__name__)
+
+# Side tables holding each model's raw payload
+PAYLOADS = {
+    Asset: AssetPayload,
+    Shape: ShapePayload,
+}
+
+
+def _fields(model):
+    return dict((field.attname, field) for field in model._meta.local_fields)
+
+
+def _dedupe(rows, key):
+    """Keep the last row for each key, ordered by key
+
+    A single statement can't touch the same row twice, and a consistent order
+    stops concurrent batches deadlocking on each other.
+    """
+    unique = dict((row[key], row) for row in rows)
+    return [unique[value] for value in sorted(unique)]
+
+
+def upsert(model, rows, key='vs_id'):
+    """Insert or update ``rows`` of ``model`` matched on the unique ``key``
+
+    :returns:
+        A dict mapping each ``key`` value to the row's primary key
+    """
+    rows = _dedupe(rows, key)
+    if not rows:
+        return {}
+    return _upsert_on_conflict(model, rows, key)
+
+
+def upsert_changed(model, rows, touch, key='vs_id', payloads=None):
+    """Like `upsert`, but skips rewriting rows whose content is unchanged
+
+    Rows whose ``content_hash`` matches the stored one only get the ``touch``
+    values (e.g. the sync they were seen in), set with a single
+    ``UPDATE ... WHERE id IN (...)``.
+
+    :param payloads:
+        Optional dict mapping ``key`` values to raw payloads, written to the
+        model's payload table for the rows that changed
+
+    :returns:
+        A dict mapping each ``key`` value to the row's primary key
+    """
+    rows = _dedupe(rows, key)
+    if not rows:
+        return {}
+    stored = dict((value, (pk, stored_hash)) for value, pk, stored_hash in
+                  model.objects.filter(**{key + '__in': [row[key] for row in rows]})
+                               .values_list(key, 'pk', 'content_hash'))
+
+    unchanged = {}
+    changed = []
+    for row in rows:
+        pk, stored_hash = stored.get(row[key], (None, None))
+        if stored_hash and stored_hash == row['content_hash']:
+            unchanged[row[key]] = pk
+        else:
+            changed.append(row)
+
+    if unchanged:
+        model.objects.filter(pk__in=unchanged.values()).update(**touch)
+    log.debug('{0}: {1} changed, {2} unchanged'.format(
+        model.__name__, len(changed), len(unchanged)))
+
+    pks = upsert(model, changed, key)
+    if payloads is not None:
+        payload_model = PAYLOADS[model]
+        owner = payload_model._meta.pk.attname
+        upsert(payload_model, [{owner: pks[row[key]],
+                                'raw_data': payloads[row[key]]}
+                               for row in changed], key=owner)
+    pks.update(unchanged)
+    return pks
+
+
+def _upsert_on_conflict(model, rows, key):
+    qn = connection.ops.quote_name
+    fields = _fields(model)
+    attnames = sorted(rows[0])
+    columns = [qn(fields[attname].column) for attname in attnames]
+    key_column = qn(fields[key].column)
+    placeholders = '({0})'.format(', '.join(['%s'] * len(attnames)))
+
+    params = []
+    for row in rows:
+        params.extend(fields[attname].get_db_prep_save(row[attname],
+                                                       connection=connection)
+                      for attname in attnames)
+
+    sql = ('INSERT INTO {table} ({columns}) VALUES {values} '
+           'ON CONFLICT ({key}) DO UPDATE SET {updates} '
+           'RETURNING {key}, {pk}').format(
+        table=qn(model._meta.db_table),
+        columns=', '.join(columns),
+        values=', '.join([placeholders] * len(rows)),
+        key=key_column,
+        updates=', '.join('{0} = EXCLUDED.{0}'.format(column)
+                          for column in columns if column != key_column),
+        pk=qn(model._meta.pk.column))
+
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    return dict(cursor.fetchall())
+
+
+def add_site_links(links):
+    """Link assets to sites, ignoring links which already exist
+
+    :param links:
+        An iterable of ``(asset_id, site_id)`` primary key pairs
+    """
+    links = sorted(set(links))
+    if not links:
+        return
+    through = Asset.sites.through
+    qn = connection.ops.quote_name
+    sql = ('INSERT INTO {table} ({asset}, {site}) VALUES {values} '
+           'ON CONFLICT DO NOTHING').format(
+        table=qn(through._meta.db_table),
+        asset=qn(through._meta.get_field('asset').column),
+        site=qn(through._meta.get_field('site').column),
+        values=', '.join(['(%s, %s)'] * len(links)))
+    params = [value for link in links for value in link]
+    connection.cursor().execute(sql, params)
+
+
+def tombstone_not_synced(model, sync_run, when):
+    """Mark live assets/shapes of the sync's site not seen by it as deleted
+
+    A single ``UPDATE ... FROM`` driven by the site's rows in the asset/site
+    link table, so it only touches the site being synced.
+
+    :returns:
+        The number of rows marked as deleted
+    """
+    if model not in (Asset, Shape):
+        raise Exception('Wierdness deleting invalid model')
+
+    qn = connection.ops.quote_name
+    through = Asset.sites.through
+    sql = ('UPDATE {table} AS t SET {deleted} = %s '
+           'FROM {links} AS l '
+           'WHERE t.{asset} = l.{link_asset} AND l.{link_site} = %s '
+           'AND t.{last_sync} <> %s AND t.{deleted} IS NULL').format(
+        table=qn(model._meta.db_table),
+        deleted=qn(model._meta.get_field('deleted').column),
+        links=qn(through._meta.db_table),
+        asset=qn('id' if model is Asset else
+                 model._meta.get_field('asset').column),
+        link_asset=qn(through._meta.get_field('asset').column),
+        link_site=qn(through._meta.get_field('site').column),
+        last_sync=qn(model._meta.get_field('last_sync').column))
+
+    cursor = connection.cursor()
+    cursor.execute(sql, [when, sync_run.site_id, sync_run.pk])
+    return cursor.rowcount
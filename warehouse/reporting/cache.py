@@ -0,0 +1,298 @@
+import os
+import json
+import errno
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class ResponseCache(object):
+    """An on-disk cache of API responses, keyed by URL
+
+    Each entry keeps the ``ETag`` and ``Last-Modified`` validators sent with the
+    response so it can be revalidated with a conditional request, plus a hash
+    of the body to tell when content is unchanged if the API sent neither.
+
+    Entries are evicted least recently used first once the files take up more
+    than ``max_size`` bytes.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.index = None  # key -> [last used, size]
+        self.total_size = 0
+        self.lock = threading.Lock()
+
+    def key(self, url):
+        return hashlib.sha1(url).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def load_index(self):
+        """Scan the cache directory, must be called with `lock` held"""
+        if self.index is not None:
+            return
+        self.index = {}
+        try:
+            os.makedirs(self.directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        for key in os.listdir(self.directory):
+            try:
+                stat = os.stat(self.path(key))
+            except OSError:
+                continue
+            self.index[key] = [stat.st_mtime, stat.st_size]
+            self.total_size += stat.st_size
+
+    def get(self, url):
+        """Return the cached entry for ``url`` (a dict) or None"""
+        key = self.key(url)
+        with self.lock:
+            self.load_index()
+            if key not in self.index:
+                return None
+        try:
+            with open(self.path(key), 'rb') as cache_file:
+                header, body = cache_file.read().split('\n', 1)
+            entry = json.loads(header)
+        except (IOError, ValueError):
+            log.debug('Discarding unreadable cache entry for {0}'.format(url))
+            self.discard(key)
+            return None
+        entry['body'] = body
+        return entry
+
+    def touch(self, url):
+        """Mark the entry for ``url`` as recently used"""
+        key = self.key(url)
+        now = time.time()
+        with self.lock:
+            if key in self.index:
+                self.index[key][0] = now
+        try:
+            os.utime(self.path(key), (now, now))
+        except OSError:
+            pass
+
+    def set(self, url, body, etag=None, last_modified=None, content_hash=None):
+        key = self.key(url)
+        header = json.dumps({
+            'url': url,
+            'etag': etag,
+            'last_modified': last_modified,
+            'hash': content_hash or self.hash(body),
+        })
+        with self.lock:
+            self.load_index()
+
+        handle, temp_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, 'wb') as cache_file:
+            cache_file.write(header + '\n' + body)
+        try:
+            os.rename(temp_path, self.path(key))
+        except OSError:
+            # Windows won't rename over an existing file
+            self.remove(self.path(key))
+            os.rename(temp_path, self.path(key))
+
+        size = len(header) + 1 + len(body)
+        with self.lock:
+            if key in self.index:
+                self.total_size -= self.index[key][1]
+            self.index[key] = [time.time(), size]
+            self.total_size += size
+            if self.total_size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """Drop least recently used entries, must be called with `lock` held"""
+        target = self.max_size * 0.9
+        by_age = sorted(self.index.items(), key=lambda item: item[1][0])
+        for key, (last_used, size) in by_age:
+            if self.total_size <= target:
+                break
+            del self.index[key]
+            self.total_size -= size
+            self.remove(self.path(key))
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.index:
+                self.total_size -= self.index.pop(key)[1]
+        self.remove(self.path(key))
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    @staticmethod
+    def hash(body):
+        return hashlib.sha1(body).hexdigest()
+
+
+class ReportCache(object):
+    """Generated reports kept on disk until a sync changes their data
+
+    Entries are grouped by site, so a completed sync only drops the reports of
+    its own site, plus those covering every site. Several processes can share
+    the directory, so rather than keeping an index each looks at the files:
+    once they take up more than ``max_size`` bytes the least recently used are
+    removed.
+
+    A ``directory`` of None disables the cache.
+    """
+
+    ALL_SITES = 'all'
+
+    def __init__(self, directory, max_size, chunk_size=64 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+
+    def group(self, site):
+        if not site:
+            return self.ALL_SITES
+        return hashlib.sha1(site.encode('utf-8')).hexdigest()[:16]
+
+    def path(self, site, key):
+        key = hashlib.sha1(json.dumps(key, sort_keys=True,
+                                      default=unicode)).hexdigest()
+        return os.path.join(self.directory, '{0}-{1}.csv'.format(
+            self.group(site), key))
+
+    def marker(self, group):
+        return os.path.join(self.directory, '{0}.invalidated'.format(group))
+
+    def ensure_directory(self):
+        try:
+            os.makedirs(self.directory)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+    def get(self, site, key):
+        """Yield the chunks of the cached report, or return None if there's
+        no entry for ``key``"""
+        if self.directory is None:
+            return None
+        path = self.path(site, key)
+        try:
+            handle = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return self.read(handle)
+
+    def read(self, handle):
+        with handle:
+            while True:
+                chunk = handle.read(self.chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def store(self, site, key, chunks):
+        """Yield ``chunks``, keeping them as the entry for ``key``
+
+        The entry is only saved once every chunk has been read and if no sync
+        of the site completed meanwhile.
+        """
+        if self.directory is None:
+            for chunk in chunks:
+                yield chunk
+            return
+
+        started = time.time()
+        self.ensure_directory()
+        handle, temp_path = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+        complete = False
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                for chunk in chunks:
+                    temp_file.write(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete and not self.invalidated_since(site, started):
+                path = self.path(site, key)
+                try:
+                    os.rename(temp_path, path)
+                except OSError:
+                    # Windows won't rename over an existing file
+                    self.remove(path)
+                    os.rename(temp_path, path)
+                self.evict()
+            else:
+                self.remove(temp_path)
+
+    def invalidated_since(self, site, when):
+        try:
+            return os.stat(self.marker(self.group(site))).st_mtime >= when
+        except OSError:
+            return False
+
+    def invalidate(self, site):
+        """Drop the reports of ``site`` and those covering every site"""
+        if self.directory is None:
+            return
+        self.ensure_directory()
+        groups = set([self.group(site), self.ALL_SITES])
+        # Reports being generated right now check these before being saved
+        for group in groups:
+            with open(self.marker(group), 'a'):
+                pass
+            os.utime(self.marker(group), None)
+        for name in os.listdir(self.directory):
+            if name.endswith('.csv') and name.split('-', 1)[0] in groups:
+                self.remove(os.path.join(self.directory, name))
+        log.debug('Invalidated cached reports of {0}'.format(
+            site or 'all sites'))
+
+    def evict(self):
+        """Drop least recently used reports while over `max_size`"""
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.endswith('.csv'):
+                entries.append((stat.st_mtime, stat.st_size, path))
+            elif name.endswith('.tmp') and now - stat.st_mtime > 24 * 60 * 60:
+                # Left behind by a process that died while writing
+                self.remove(path)
+
+        total_size = sum(size for _, size, _ in entries)
+        target = self.max_size * 0.9
+        if total_size <= self.max_size:
+            return
+        for last_used, size, path in sorted(entries):
+            if total_size <= target:
+                break
+            self.remove(path)
+            total_size -= size
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
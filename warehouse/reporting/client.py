@@ -0,0 +1,293 @@
+import os
+import time
+import logging
+import threading
+import urlparse
+import tempfile
+from email.utils import parsedate_tz, mktime_tz
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+
+from reporting import metrics
+from reporting.cache import ResponseCache
+
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = (500, 502, 503, 504)
+THROTTLED = 429
+NOT_MODIFIED = 304
+
+
+class BorkAPIError(Exception):
+    """The Bork API could not be reached or kept returning server errors"""
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a ``Retry-After`` header (seconds or a HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(mktime_tz(parsed) - time.time(), 0)
+
+
+class RateLimiter(object):
+    """Throttle calls to the API so a sync runs as fast as it can take
+
+    Combines a token bucket capping the request rate with an adaptive limit on
+    the number of calls in flight (AIMD). The limit grows by one for every
+    ``limit`` calls that succeed within ``latency_target`` seconds and halves
+    when calls fail, are throttled or are slow, at most once per
+    ``latency_target``. A ``Retry-After`` pauses every caller.
+    """
+
+    def __init__(self, rate=None, burst=None, min_concurrency=1,
+                 max_concurrency=20, latency_target=2.0):
+        self.rate = rate
+        self.burst = burst or max(rate or 1, 1)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(max_concurrency)
+        self.latency_target = latency_target
+        self.in_flight = 0
+        self.paused_until = 0
+        self.decreased = 0
+        self.condition = threading.Condition()
+
+    def set_rate(self, rate, burst=None):
+        with self.condition:
+            self.rate = rate
+            self.burst = burst or max(rate or 1, 1)
+            self.tokens = min(self.tokens, self.burst)
+
+    def take_token(self, now):
+        """Take a token from the bucket, or return how long until there is one"""
+        if not self.rate:
+            return 0
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Block until a call may be made"""
+        with self.condition:
+            while True:
+                now = time.time()
+                wait = self.paused_until - now
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    wait = self.take_token(now)
+                    if wait <= 0:
+                        self.in_flight += 1
+                        return
+                self.condition.wait(wait if wait > 0 else None)
+
+    def release(self, latency, failed=False, retry_after=None):
+        """Record the outcome of a call made after `acquire`"""
+        with self.condition:
+            now = time.time()
+            self.in_flight -= 1
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if failed or retry_after or latency > self.latency_target:
+                if now - self.decreased >= self.latency_target:
+                    self.decreased = now
+                    self.limit = max(self.min_concurrency, self.limit / 2)
+                    log.debug('Reduced API concurrency to {0}'.format(
+                        int(self.limit)))
+            elif self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency,
+                                 self.limit + 1.0 / self.limit)
+            self.condition.notify_all()
+
+
+class BorkClient(object):
+    """Shared HTTP client for the Bork/Vidispine API
+
+    Keeps one keep-alive `requests.Session` per host *and* per thread (sessions
+    are not thread-safe), each with a connection pool and the auth headers
+    already set, so consecutive calls reuse the same TCP connection.
+
+    Configured from settings:
+
+    ``BORK_POOL_SIZE``
+        Connections kept alive per host, per thread. Default 10
+    ``BORK_TIMEOUT``
+        ``(connect, read)`` timeouts in seconds. Default ``(5, 60)``
+    ``BORK_MAX_RETRIES``
+        Attempts made for each call on connection errors and 5xx responses
+        before giving up. Default 3
+    ``BORK_RETRY_BACKOFF``
+        ``(multiplier, max)`` seconds for the exponential wait between
+        attempts. Default ``(1, 10)``
+    ``BORK_RATE_LIMIT``
+        Maximum requests per second across all threads. Default unlimited
+    ``BORK_CONCURRENCY``
+        ``(min, max)`` calls in flight, adjusted by the `RateLimiter` between
+        the two. Default ``(1, 20)``
+    ``BORK_LATENCY_TARGET``
+        Seconds a call may take before concurrency is reduced. Default 2
+    ``BORK_CACHE_DIR``
+        Where `get_cached` keeps responses. Default ``warehouse-bork-cache``
+        in the temp directory, ``None`` disables the cache
+    ``BORK_CACHE_MAX_SIZE``
+        Bytes of responses kept before evicting. Default 1GB
+    """
+
+    def __init__(self, auth=None, pool_size=None, timeout=None,
+                 max_retries=None, backoff=None, limiter=None, cache=None):
+        self.auth = auth
+        self.pool_size = pool_size or getattr(settings, 'BORK_POOL_SIZE', 10)
+        self.timeout = timeout or getattr(settings, 'BORK_TIMEOUT', (5, 60))
+        self.max_retries = max_retries or getattr(settings, 'BORK_MAX_RETRIES', 3)
+        self.backoff = backoff or getattr(settings, 'BORK_RETRY_BACKOFF', (1, 10))
+        self.local = threading.local()
+        if limiter is None:
+            min_concurrency, max_concurrency = getattr(
+                settings, 'BORK_CONCURRENCY', (1, 20))
+            limiter = RateLimiter(
+                rate=getattr(settings, 'BORK_RATE_LIMIT', None),
+                min_concurrency=min_concurrency,
+                max_concurrency=max_concurrency,
+                latency_target=getattr(settings, 'BORK_LATENCY_TARGET', 2.0))
+        self.limiter = limiter
+        if cache is None:
+            directory = getattr(settings, 'BORK_CACHE_DIR', os.path.join(
+                tempfile.gettempdir(), 'warehouse-bork-cache'))
+            if directory:
+                cache = ResponseCache(directory, getattr(
+                    settings, 'BORK_CACHE_MAX_SIZE', 1024 ** 3))
+        self.cache = cache or None
+
+    def headers(self):
+        headers = {'content-type': 'application/json'}
+        headers.update(self.auth if self.auth is not None else settings.BORK_AUTH)
+        return headers
+
+    def session_for(self, url):
+        """Return this thread's session for the host of ``url``"""
+        sessions = getattr(self.local, 'sessions', None)
+        if sessions is None:
+            sessions = self.local.sessions = {}
+        parts = urlparse.urlsplit(url)
+        host = '{0}://{1}'.format(parts.scheme, parts.netloc)
+        if host not in sessions:
+            session = requests.Session()
+            session.headers.update(self.headers())
+            adapter = HTTPAdapter(pool_connections=1,
+                                  pool_maxsize=self.pool_size)
+            session.mount(host, adapter)
+            sessions[host] = session
+        return sessions[host]
+
+    def wait(self, attempt):
+        multiplier, maximum = self.backoff
+        return min(multiplier * 2 ** attempt, maximum)
+
+    def get(self, url, params=None, headers=None):
+        """GET ``url``, retrying on connection errors and server errors
+
+        Calls are throttled by `limiter`. Throttled (429) responses are retried
+        once the ``Retry-After`` period has passed.
+        """
+        session = self.session_for(url)
+        attempt = 0
+        while True:
+            attempt += 1
+            self.limiter.acquire()
+            metrics.incr('http_requests')
+            started = time.time()
+            try:
+                response = session.get(url, params=params, headers=headers,
+                                       timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                self.limiter.release(time.time() - started, failed=True)
+                metrics.incr('http_errors')
+                log.debug('HTTP Request to {0} failed: {1}'.format(url, exc))
+                if attempt >= self.max_retries:
+                    raise BorkAPIError('Unable to retrieve data: {0}'.format(exc))
+                metrics.incr('http_retries')
+            except Exception:
+                self.limiter.release(time.time() - started, failed=True)
+                raise
+            else:
+                status = response.status_code
+                retry_after = None
+                if status == THROTTLED:
+                    retry_after = (parse_retry_after(
+                        response.headers.get('Retry-After')) or
+                        self.wait(attempt))
+                self.limiter.release(time.time() - started,
+                                     failed=status in RETRY_STATUSES,
+                                     retry_after=retry_after)
+                log.debug('HTTP Request performed to: {0} [status: {1}]'.format(
+                    url, status))
+                if status not in RETRY_STATUSES and status != THROTTLED:
+                    return response
+                log.debug('warning status {0}'.format(status))
+                metrics.incr('http_throttled' if status == THROTTLED
+                             else 'http_errors')
+                if attempt >= self.max_retries:
+                    raise BorkAPIError('Unable to retrieve data')
+                metrics.incr('http_retries')
+                if retry_after:
+                    continue  # The limiter holds every call back until then
+            time.sleep(self.wait(attempt))
+
+    def get_cached(self, url):
+        """GET the body of ``url``, revalidating against `cache`
+
+        A cached response is sent back with ``If-None-Match`` and
+        ``If-Modified-Since`` so unchanged items only cost a 304. When the API
+        gave no validators the body is downloaded again, but the cache entry is
+        only rewritten if its hash changed.
+        """
+        if self.cache is None:
+            return self.get(url).content
+
+        entry = self.cache.get(url)
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        response = self.get(url, headers=headers)
+        if response.status_code == NOT_MODIFIED and entry:
+            metrics.incr('http_not_modified')
+            self.cache.touch(url)
+            return entry['body']
+
+        body = response.content
+        content_hash = self.cache.hash(body)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if (entry and entry['hash'] == content_hash and
+                entry['etag'] == etag and
+                entry['last_modified'] == last_modified):
+            self.cache.touch(url)
+        elif response.status_code == 200:
+            self.cache.set(url, body, etag, last_modified, content_hash)
+        return body
+
+    def close(self):
+        """Close the calling thread's sessions"""
+        for session in getattr(self.local, 'sessions', {}).values():
+            session.close()
+        self.local.sessions = {}
+
+
+client = BorkClient()
@@ -0,0 +1,57 @@
+"""Derive reportable columns from raw API payloads
+
+Used both when syncing and by the ``reindex_from_raw`` command, so a fix here
+can be applied to every stored row without calling the API again.
+"""
+import logging
+
+from dateutil import parser
+
+
+log = logging.getLogger(__name__)
+
+FILENAME_KEYS = ('filename', 'original_filename', 'originalFilename')
+TIMESTAMP_KEYS = ('created', 'timestamp')
+
+
+def _first(data, keys):
+    for key in keys:
+        if data.get(key):
+            return data[key]
+    return None
+
+
+def _int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _datetime(value):
+    if not value:
+        return None
+    try:
+        return parser.parse(value)
+    except (TypeError, ValueError, OverflowError):
+        log.debug('Unparseable timestamp {0!r}'.format(value))
+        return None
+
+
+def asset_columns(raw_data):
+    """Columns of `Asset` derived from its raw payload"""
+    metadata = raw_data.get('metadata') or {}
+    filename = _first(metadata, FILENAME_KEYS) or _first(raw_data,
+                                                         FILENAME_KEYS)
+    return {
+        'filename': filename and filename[:255],
+    }
+
+
+def shape_columns(raw_data):
+    """Columns of `Shape` derived from its raw payload"""
+    return {
+        'size': _int(raw_data.get('size')),
+        'version': _int(raw_data.get('version')),
+        'timestamp': _datetime(_first(raw_data, TIMESTAMP_KEYS)),
+    }
@@ -0,0 +1,113 @@
+"""Model fields and lookups for the raw API payloads
+
+`JSONBField` stores JSON as native Postgres ``jsonb`` so it can be indexed and
+queried without casting every row. Keys can be traversed in filters, e.g.::
+
+    Asset.objects.filter(
+        payload__raw_data__metadata__zonza_site='trials.zonza.tv')
+
+compiles to ``raw_data -> 'metadata' ->> 'zonza_site' = ...``, which matches the
+expression indexes on the payload table, and::
+
+    Asset.objects.filter(
+        payload__raw_data__contains={'metadata': {'user': 'bob'}})
+
+compiles to ``raw_data @> ...``, which can use the GIN index.
+"""
+import json
+
+import jsonfield
+from django.db.models import Lookup, TextField, Transform
+from django.db.models.lookups import default_lookups
+
+
+class JSONBField(jsonfield.JSONField):
+    """A `jsonfield.JSONField` stored as ``jsonb``"""
+
+    def db_type(self, connection):
+        return 'jsonb'
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(JSONBField, self).deconstruct()
+        return name, 'reporting.fields.JSONBField', args, kwargs
+
+    def get_transform(self, name):
+        transform = super(JSONBField, self).get_transform(name)
+        if transform is not None:
+            return transform
+        return KeyTransformFactory(name)
+
+
+class KeyTransform(Transform):
+    """Traverse into a key of a JSON object
+
+    The last key in a path is extracted as text (``->>``) so it can be compared
+    with plain strings, keys before it stay ``jsonb`` (``->``).
+    """
+
+    def __init__(self, key_name, lhs, lookups):
+        super(KeyTransform, self).__init__(lhs, lookups)
+        self.key_name = key_name
+        # ``lookups`` starts with our own key, anything after is what's
+        # applied to the result: another key, or the final lookup. Keys stay
+        # ``jsonb`` for the ``jsonb`` lookups (``contains``, ``has_key``)
+        following = lookups[1] if len(lookups) > 1 else None
+        self.as_text = following is None or (
+            following in default_lookups and
+            following not in JSONBField.class_lookups)
+
+    @property
+    def output_field(self):
+        if self.as_text:
+            return TextField()
+        return JSONBField()
+
+    def as_sql(self, qn, connection):
+        lhs, params = qn.compile(self.lhs)
+        operator = '->>' if self.as_text else '->'
+        return '({0} {1} %s)'.format(lhs, operator), params + [self.key_name]
+
+    def relabeled_clone(self, relabels):
+        return self.__class__(self.key_name, self.lhs.relabeled_clone(relabels),
+                              self.init_lookups)
+
+
+class KeyTransformFactory(object):
+
+    def __init__(self, key_name):
+        self.key_name = key_name
+
+    def __call__(self, lhs, lookups):
+        return KeyTransform(self.key_name, lhs, lookups)
+
+
+class JSONBLookup(Lookup):
+    """A lookup whose right hand side is JSON encoded and cast to ``jsonb``"""
+
+    operator = None
+
+    def get_prep_lookup(self):
+        return self.rhs
+
+    def as_sql(self, qn, connection):
+        lhs, params = self.process_lhs(qn, connection)
+        return ('{0} {1} %s::jsonb'.format(lhs, self.operator),
+                params + [json.dumps(self.rhs)])
+
+
+@JSONBField.register_lookup
+class ContainsLookup(JSONBLookup):
+    lookup_name = 'contains'
+    operator = '@>'
+
+
+@JSONBField.register_lookup
+class HasKeyLookup(Lookup):
+    lookup_name = 'has_key'
+
+    def get_prep_lookup(self):
+        return self.rhs
+
+    def as_sql(self, qn, connection):
+        lhs, params = self.process_lhs(qn, connection)
+        return '{0} ? %s'.format(lhs), params + [self.rhs]
@@ -0,0 +1,172 @@
+from optparse import make_option
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from reporting.benchmark import FakeBork
+from reporting.client import client
+from reporting.models import AllSitesSummary, Asset, Shape, Site, SyncRun
+
+
+log = logging.getLogger(__name__)
+
+
+class QueryCounter(object):
+    """Count queries made on every connection opened while it's active
+
+    Each sync worker thread has its own connection, so the main thread's
+    ``connection.queries`` alone would miss most of them.
+    """
+
+    def __init__(self):
+        self.connections = []
+
+    def track(self, sender, connection, **kwargs):
+        connection.use_debug_cursor = True
+        self.connections.append(connection)
+
+    def __enter__(self):
+        for connection in connections.all():
+            connection.use_debug_cursor = True
+            connection.queries = []
+            self.connections.append(connection)
+        connection_created.connect(self.track)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.track)
+
+    @property
+    def count(self):
+        return sum(len(connection.queries) for connection in self.connections)
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Times sync_report_data end to end against a local fake Bork API '
+            'and reports assets/sec, HTTP calls and DB queries per asset. '
+            'Writes to the configured database, so only runs with DEBUG on '
+            'unless given --force')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--items', dest='items', type='int', default=1000,
+            help='Number of assets to sync. Default is 1000'),
+        make_option('--shapes', dest='shapes', type='int', default=3,
+            help='Shapes per asset. Default is 3'),
+        make_option('--latency', dest='latency', type='float', default=0,
+            help='Milliseconds added to every API response. Default is 0'),
+        make_option('--error-rate', dest='error_rate', type='float', default=0,
+            help='Fraction of API calls answered with a 500. Default is 0'),
+        make_option('--throttle-rate', dest='throttle_rate', type='float',
+            default=0,
+            help='Fraction of API calls answered with a 429. Default is 0'),
+        make_option('--etags', action='store_true', dest='etags',
+            default=False,
+            help='Have the fake API send ETags and answer with 304s'),
+        make_option('--runs', dest='runs', type='int', default=1,
+            help='Number of back to back syncs, e.g. 2 to time a resync of '
+                 'unchanged data. Default is 1'),
+        make_option('-w', '--workers', dest='workers', default='1',
+            help='Passed on to sync_report_data. Default is 1'),
+        make_option('-b', '--batch-size', dest='batch_size',
+            help='Passed on to sync_report_data'),
+        make_option('--per-page', dest='per_page',
+            help='Passed on to sync_report_data'),
+        make_option('--prefetch', dest='prefetch',
+            help='Passed on to sync_report_data'),
+        make_option('--cache', action='store_true', dest='cache',
+            default=False,
+            help='Use the on-disk response cache (off by default)'),
+        make_option('--keep', action='store_true', dest='keep', default=False,
+            help="Don't delete the benchmark site's data afterwards"),
+        make_option('--force', action='store_true', dest='force',
+            default=False,
+            help='Run even though DEBUG is off, i.e. against what may be the '
+                 'production database'),
+    )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError(
+                'The benchmark writes a site to the configured database and '
+                'its syncs refresh the dashboard summaries. Run it with DEBUG '
+                'on, or pass --force to run it anyway')
+        domain = 'benchmark.zonza.tv'
+        bork = FakeBork(domain, items=options['items'],
+                        shapes=options['shapes'],
+                        latency=options['latency'] / 1000.0,
+                        error_rate=options['error_rate'],
+                        throttle_rate=options['throttle_rate'],
+                        etags=options['etags']).start()
+
+        sync_options = {'zonza_site': domain}
+        for name in ('workers', 'batch_size', 'per_page', 'prefetch'):
+            if options.get(name) is not None:
+                sync_options[name] = options[name]
+        if not options['cache']:
+            sync_options['no_cache'] = True
+
+        original_url = settings.BORK_URL
+        settings.BORK_URL = bork.url
+        cache = client.cache
+        print "Fake Bork API at {0}".format(bork.url)
+        try:
+            for run in range(1, options['runs'] + 1):
+                self.run_sync(run, bork, sync_options)
+        finally:
+            settings.BORK_URL = original_url
+            client.cache = cache
+            bork.stop()
+            if not options['keep']:
+                self.cleanup(domain)
+
+    def run_sync(self, run, bork, sync_options):
+        requests_before = bork.requests
+        with QueryCounter() as queries:
+            started = time.time()
+            call_command('sync_report_data', **sync_options)
+            elapsed = time.time() - started
+
+        assets = bork.items
+        sync_run = SyncRun.objects.filter(site__domain=bork.site) \
+                                  .order_by('-pk')[0]
+        counters = (sync_run.stats or {}).get('counters', {})
+        print
+        print "Run {0}: {1} assets, {2} shapes each".format(
+            run, assets, bork.shapes_per_item)
+        print "  Elapsed:          {0:.2f}s".format(elapsed)
+        print "  Assets/sec:       {0:.1f}".format(assets / elapsed)
+        print "  HTTP calls/asset: {0:.2f}".format(
+            float(bork.requests - requests_before) / assets)
+        print "  DB queries/asset: {0:.2f}".format(float(queries.count) / assets)
+        print "  HTTP errors:      {0} ({1} retries, {2} throttled)".format(
+            counters.get('http_errors', 0), counters.get('http_retries', 0),
+            counters.get('http_throttled', 0))
+        for stage, timing in sync_run.stage_timings():
+            print "  {0:<17} p50 {1:.4f}s  p95 {2:.4f}s  total {3:.2f}s".format(
+                stage + ':', timing['p50'], timing['p95'], timing['total'])
+
+    def cleanup(self, domain):
+        """Delete the benchmark site and the assets only it has
+
+        Assets also linked to other sites are just unlinked from it.
+        """
+        # Annotated before filtering, so every site of the asset is counted
+        own_assets = Asset.objects.annotate(site_count=Count('sites')) \
+                                  .filter(site_count=1, sites__domain=domain) \
+                                  .values_list('pk', flat=True)
+        own_assets = list(own_assets)
+        Shape.objects.filter(asset__in=own_assets).delete()
+        Asset.objects.filter(pk__in=own_assets).delete()
+        Asset.sites.through.objects.filter(site__domain=domain).delete()
+        SyncRun.objects.filter(site__domain=domain).delete()
+        # Takes its summary and storage rollup with it
+        Site.objects.filter(domain=domain).delete()
+        # The totals over all sites counted the benchmark's assets
+        AllSitesSummary.refresh()
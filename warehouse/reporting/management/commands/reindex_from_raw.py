@@ -0,0 +1,205 @@
+from optparse import make_option
+import json
+import logging
+import multiprocessing
+import threading
+import time
+import traceback
+
+import django
+from django.db import connection, connections, transaction
+from django.core.management.base import BaseCommand, CommandError
+
+from reporting import extract
+from reporting.models import Asset, AssetPayload, Shape, ShapePayload
+
+
+log = logging.getLogger(__name__)
+
+# What can be rebuilt: name -> (model, its payload model, function deriving
+# the columns)
+TARGETS = {
+    'assets': (Asset, AssetPayload, extract.asset_columns),
+    'shapes': (Shape, ShapePayload, extract.shape_columns),
+}
+
+
+def close_connections():
+    for conn in connections.all():
+        conn.close()
+
+
+def init_worker():
+    # Needed where workers are spawned rather than forked (i.e. Windows)
+    django.setup()
+    close_connections()
+
+
+def stream_rows(payload_model, batch_size):
+    """Yield lists of ``(id, raw_data)`` for every row of ``payload_model``
+
+    Rows come from a server-side (named) cursor so memory use doesn't grow
+    with the table.
+    """
+    qn = connection.ops.quote_name
+    table = qn(payload_model._meta.db_table)
+    pk = qn(payload_model._meta.pk.column)
+    with transaction.atomic():
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(name='reindex_from_raw')
+        cursor.itersize = batch_size
+        cursor.execute('SELECT {0}, raw_data FROM {1} ORDER BY {0}'.format(
+            pk, table))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+        cursor.close()
+
+
+def reindex_batch(args):
+    """Derive the columns for a batch of rows and write any that changed
+
+    Runs in a worker process. The batch is written with a single
+    ``UPDATE ... FROM (VALUES ...)`` that skips rows already up to date.
+
+    :returns:
+        ``(rows seen, rows updated)``
+    """
+    target, rows = args
+    model, payload_model, derive = TARGETS[target]
+
+    values = []
+    for pk, raw_data in rows:
+        if isinstance(raw_data, basestring):
+            raw_data = json.loads(raw_data)
+        values.append((pk, derive(raw_data or {})))
+    if not values:
+        return 0, 0
+    names = sorted(values[0][1])
+    fields = dict((name, model._meta.get_field(name)) for name in names)
+
+    with transaction.atomic():
+        qn = connection.ops.quote_name
+        columns = [qn(fields[name].column) for name in names]
+        row_sql = '(%s, {0})'.format(', '.join(
+            '%s::{0}'.format(fields[name].db_type(connection))
+            for name in names))
+        params = []
+        for pk, derived in values:
+            params.append(pk)
+            params.extend(fields[name].get_db_prep_save(derived[name],
+                                                        connection=connection)
+                          for name in names)
+        sql = ('UPDATE {table} AS t SET {updates} '
+               'FROM (VALUES {values}) AS v (id, {columns}) '
+               'WHERE t.id = v.id AND ({changed})').format(
+            table=qn(model._meta.db_table),
+            updates=', '.join('{0} = v.{0}'.format(column)
+                              for column in columns),
+            values=', '.join([row_sql] * len(values)),
+            columns=', '.join(columns),
+            changed=' OR '.join('t.{0} IS DISTINCT FROM v.{0}'.format(column)
+                                for column in columns))
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        return len(rows), cursor.rowcount
+
+
+def reindex_worker(args):
+    """`reindex_batch` with failures reported back rather than raised
+
+    :returns:
+        ``(rows seen, rows updated, traceback or None)``
+    """
+    try:
+        return reindex_batch(args) + (None,)
+    except Exception:
+        return 0, 0, traceback.format_exc()
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Rebuilds the columns derived from raw_data (asset filename, shape '
+            'size, version and timestamp) without calling the API')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-m',
+            '--models',
+            dest='models',
+            default='assets,shapes',
+            help='Comma separated list of what to rebuild. Default is '
+                 'assets,shapes'),
+        make_option(
+            '-b',
+            '--batch-size',
+            dest='batch_size',
+            type='int',
+            default=2000,
+            help='Rows per read and per update. Default is 2000'),
+        make_option(
+            '-p',
+            '--processes',
+            dest='processes',
+            type='int',
+            help='Number of worker processes. Defaults to the number of CPUs'),
+    )
+
+    def handle(self, *args, **options):
+        targets = [name.strip() for name in options['models'].split(',')]
+        for target in targets:
+            if target not in TARGETS:
+                raise CommandError('Can only reindex {0}'.format(
+                    ', '.join(sorted(TARGETS))))
+        processes = options.get('processes') or multiprocessing.cpu_count()
+        batch_size = max(options['batch_size'], 1)
+
+        # Connections can't be shared with the worker processes
+        close_connections()
+        pool = multiprocessing.Pool(processes, initializer=init_worker)
+        try:
+            for target in targets:
+                self.reindex(pool, processes, target, batch_size)
+        finally:
+            pool.close()
+            pool.join()
+
+    def reindex(self, pool, processes, target, batch_size):
+        started = time.time()
+        totals = {'seen': 0, 'updated': 0}
+        errors = []
+        # Keep a couple of batches queued per worker, no more, so memory
+        # stays flat however big the table is
+        pending = threading.BoundedSemaphore(processes * 2)
+
+        def done(result):
+            seen, updated, error = result
+            totals['seen'] += seen
+            totals['updated'] += updated
+            if error:
+                errors.append(error)
+            pending.release()
+
+        print "Reindexing {0} with {1} processes...".format(target, processes)
+        batches = stream_rows(TARGETS[target][1], batch_size)
+        try:
+            for rows in batches:
+                if errors:
+                    break
+                pending.acquire()
+                pool.apply_async(reindex_worker, ((target, rows),),
+                                 callback=done)
+        finally:
+            batches.close()
+
+        # Wait for the outstanding batches
+        for _ in range(processes * 2):
+            pending.acquire()
+        if errors:
+            raise CommandError('Reindexing {0} failed:\n{1}'.format(
+                target, errors[0]))
+
+        print "{0}: {1} rows read, {2} updated in {3:.1f}s".format(
+            target, totals['seen'], totals['updated'], time.time() - started)
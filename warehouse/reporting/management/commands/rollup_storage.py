@@ -0,0 +1,68 @@
+from datetime import timedelta
+from optparse import make_option
+
+from dateutil import parser
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+
+from reporting.models import Asset, DailyStorage, Site, today
+
+
+class Command(BaseCommand):
+    args = ''
+    help = ('Rebuilds the daily storage rollup of each site from the created '
+            'and deleted dates of its assets and shapes')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-z',
+            '--zonza',
+            dest='zonza_site',
+            help='Only rebuild these sites, separated by commas. Default is '
+                 'every site'),
+        make_option(
+            '--start',
+            dest='start',
+            help='First day to rebuild (YYYY-MM-DD). Default is the day the '
+                 'site\'s first asset was created'),
+        make_option(
+            '--end',
+            dest='end',
+            help='Last day to rebuild (YYYY-MM-DD). Default is today'),
+    )
+
+    def handle(self, *args, **options):
+        sites = Site.objects.order_by('domain')
+        if options.get('zonza_site'):
+            domains = [domain.strip() for domain in
+                       options['zonza_site'].split(',') if domain.strip()]
+            sites = sites.filter(domain__in=domains)
+            missing = set(domains) - set(site.domain for site in sites)
+            if missing:
+                raise CommandError('Unknown sites: {0}'.format(
+                    ', '.join(sorted(missing))))
+
+        try:
+            start, end = [parser.parse(options[name]).date()
+                          if options.get(name) else None
+                          for name in ('start', 'end')]
+        except ValueError:
+            raise CommandError('Dates must be in the form YYYY-MM-DD')
+        end = end or today()
+
+        for site in sites:
+            first = start
+            if first is None:
+                created = Asset.objects.filter(sites=site) \
+                                       .aggregate(first=Min('created'))
+                if created['first'] is None:
+                    continue
+                first = created['first'].date()
+
+            days = (end - first).days + 1
+            print "Rebuilding {0} days of {1}".format(max(days, 0),
+                                                      site.domain)
+            for day in range(days):
+                DailyStorage.snapshot(site, first + timedelta(days=day))
+        print "...Done!"
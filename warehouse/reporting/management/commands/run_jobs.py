@@ -0,0 +1,105 @@
+from optparse import make_option
+import logging
+import multiprocessing
+import os
+import socket
+import time
+
+import django
+from django.conf import settings
+from django.db import connections
+from django.core.management.base import BaseCommand
+
+from reporting import tasks
+from reporting.models import Job
+
+
+log = logging.getLogger(__name__)
+
+
+def close_connections():
+    for conn in connections.all():
+        conn.close()
+
+
+def work(poll, once):
+    """Run queued jobs one after another, polling for more when idle
+
+    While idle, jobs of workers which stopped sending heartbeats are queued
+    again and old results removed.
+    """
+    if multiprocessing.current_process().name != 'MainProcess':
+        # Needed where workers are spawned rather than forked (i.e. Windows)
+        django.setup()
+    worker = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+    keep_days = getattr(settings, 'JOB_KEEP_RESULTS_DAYS', 7)
+    stale_after = getattr(settings, 'JOB_STALE_AFTER', 300)
+    while True:
+        job = Job.claim(worker)
+        if job is not None:
+            tasks.run(job)
+            continue
+        if once:
+            return
+        stale = Job.requeue_stale(stale_after)
+        if stale:
+            log.warning('Queued {0} jobs of dead workers again'.format(stale))
+        tasks.remove_old_results(keep_days)
+        # Don't hold a connection open while idle
+        close_connections()
+        time.sleep(poll)
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Runs queued report and sync jobs in worker processes'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '-p',
+            '--processes',
+            dest='processes',
+            type='int',
+            default=1,
+            help='Number of worker processes, i.e. jobs run at once. '
+                 'Default is 1'),
+        make_option(
+            '--poll',
+            dest='poll',
+            type='float',
+            default=getattr(settings, 'JOB_POLL_INTERVAL', 5),
+            help='Seconds to wait before looking for new jobs when idle'),
+        make_option(
+            '--once',
+            action='store_true',
+            dest='once',
+            default=False,
+            help='Exit once there are no queued jobs left, e.g. to run '
+                 'from cron'),
+    )
+
+    def handle(self, *args, **options):
+        stale = Job.requeue_stale(getattr(settings, 'JOB_STALE_AFTER', 300))
+        if stale:
+            print "Queued {0} jobs of dead workers again".format(stale)
+
+        processes = max(options['processes'], 1)
+        if processes == 1:
+            work(options['poll'], options['once'])
+            return
+
+        # Connections can't be shared with the worker processes
+        close_connections()
+        workers = [multiprocessing.Process(target=work, name='job-worker-{0}'
+                                           .format(number),
+                                           args=(options['poll'],
+                                                 options['once']))
+                   for number in range(processes)]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
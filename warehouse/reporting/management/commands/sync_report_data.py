@@ -2,122 +2,380 @@ import sys
 from optparse import make_option
 from datetime import datetime
 import logging
+import threading
+import Queue
 import uuid
+from collections import defaultdict, deque
 
-#from multiprocessing import Pool
-#from multiprocessing.dummy import Pool as ThreadPool
-
-from django.db import transaction, IntegrityError
+from django.db import connection, transaction, IntegrityError
 from django.utils import timezone
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
-from reporting.models import (Asset, Shape, get_asset, SyncRun, Site, dump_json,
-                              get_shapes_for_asset, get_shape, asset_iterator)
+from reporting import bulk, extract
+from reporting.client import client
+from reporting.metrics import SyncMetrics, incr, timer
+from reporting.models import (Asset, Shape, get_asset, SyncRun, Site, PER_PAGE,
+                              get_shapes_for_asset, get_shape, asset_iterator,
+                              content_hash)
 
 
 log = logging.getLogger(__name__)
 
+_DONE = object()
+
 
-def update_progress(current, total):
+def update_progress(current, total, label=''):
     progress = int(float(current) * 100 / total)
     complete = progress/10
-    message = '\rProgress: [{0}] {1}% ({2}/{3})'
+    message = '\r{4}Progress: [{0}] {1}% ({2}/{3})'
     bar = '#' * complete + ' ' * (10-complete)
-    sys.stdout.write(message.format(bar, progress, current, total))
+    sys.stdout.write(message.format(bar, progress, current, total, label))
     sys.stdout.flush()
 
 
+class Progress(object):
+    """Thread-safe counter of processed assets, reported on stdout
+
+    Sites synced at the same time would redraw each other's progress bar, so
+    with ``lines`` a line is printed every 10% instead.
+    """
+
+    def __init__(self, label='', lines=False):
+        self.done = 0
+        self.label = label
+        self.lines = lines
+        self.reported = 0  # Tenths printed so far, with ``lines``
+        self.lock = threading.Lock()
+
+    def increment(self, total):
+        with self.lock:
+            self.done += 1
+            if not self.lines:
+                update_progress(self.done, total, self.label)
+                return
+            tenths = self.done * 10 // total
+            if tenths > self.reported:
+                self.reported = tenths
+                # One write, so lines from different sites don't interleave
+                sys.stdout.write('{0}Progress: {1}% ({2}/{3})\n'.format(
+                    self.label, self.done * 100 // total, self.done, total))
+                sys.stdout.flush()
+
+
+class FairSemaphore(object):
+    """A semaphore which hands out slots in the order they were asked for
+
+    Used to cap the total number of assets being synced at once across sites.
+    Freed slots are handed straight to the longest waiting thread, so a site
+    with a lot of work can't keep grabbing them back from the others.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.waiters = deque()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.value and not self.waiters:
+                self.value -= 1
+                return
+            waiter = threading.Event()
+            self.waiters.append(waiter)
+        waiter.wait()
+
+    def release(self):
+        with self.lock:
+            if self.waiters:
+                self.waiters.popleft().set()
+            else:
+                self.value += 1
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+def run_concurrently(func, items, workers):
+    """Call ``func`` on each of ``items`` from a pool of ``workers`` threads
+
+    Items are handed over through a bounded queue so the (lazy) iterator is only
+    consumed as fast as the workers can keep up. The first exception raised by a
+    worker stops the pool and is re-raised in the calling thread.
+    """
+    tasks = Queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    errors = []
+
+    def worker():
+        try:
+            while True:
+                item = tasks.get()
+                if item is _DONE:
+                    break
+                if stop.is_set():
+                    continue  # Drain the queue so the feeder never blocks
+                try:
+                    func(item)
+                except Exception:
+                    errors.append(sys.exc_info())
+                    stop.set()
+        finally:
+            # Each thread gets its own DB connection and HTTP sessions, don't
+            # leak them
+            connection.close()
+            client.close()
+
+    threads = [threading.Thread(target=worker, name='sync-{0}'.format(num))
+               for num in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        for item in items:
+            if stop.is_set():
+                break
+            tasks.put(item)
+    except:
+        stop.set()
+        raise
+    finally:
+        for _ in threads:
+            tasks.put(_DONE)
+        for thread in threads:
+            thread.join()
+
+    if errors:
+        exc_type, exc_value, exc_tb = errors[0]
+        raise exc_type, exc_value, exc_tb
+
+
 def delete_not_synced(model, sync_run):
     """Set delete time of any assets/shapes not found in this sync
 
     (but were found in a previous one *for the same site*)
 
     Exclude: model.sites or model.asset.sites != sync_run.site
+
+    :returns:
+        The number of rows newly marked as deleted
+    """
+    with timer('deletion_sweep'):
+        delete_count = bulk.tombstone_not_synced(model, sync_run,
+                                                 timezone.now())
+    msg = 'Set delete time for {0} {1} not found in this sync'
+    log.debug(msg.format(delete_count, model))
+    return delete_count
+
+
+def get_site(domain):
+    """Fetch (or create) the `Site` for ``domain``"""
+    # Get_or_create NOT threadsafe!!
+    try:
+        return Site.objects.get(domain=domain)
+    except Site.DoesNotExist:
+        try:
+            with transaction.atomic():
+                return Site.objects.create(domain=domain)
+        except IntegrityError:
+            return Site.objects.get(domain=domain)
+
+
+def fetch_asset(asset_data):
+    """Retrieve an asset and all of its shapes from the API
+
+    No database access happens here so that slow HTTP calls are never made
+    while a transaction is held open.
     """
-    not_found = model.objects.exclude(last_sync=sync_run)
-    if hasattr(model, 'sites'):  # Asset
-        to_delete = not_found.filter(sites=sync_run.site)
-    elif hasattr(model, 'asset'):  # Shape
-        to_delete = not_found.filter(asset__sites=sync_run.site)
-    else:
-        raise Exception('Wierdness deleting invalid model')
-
-    delete_count = to_delete.count()
-    if delete_count:
-        msg = 'Setting delete time for {0} {1} not found in this sync'
-        log.debug(msg.format(delete_count, model))
-        to_delete.update(deleted=timezone.now())
-    else:
-        msg = '{} items not found but none missing for current sync site'
-        log.debug(msg.format(not_found.count()))
-
-
-def process_single_asset(asset_data):
     try:
         asset_id = asset_data.get('id')
         asset_url = asset_data.get('url')
-        full_asset_data = get_asset(asset_url)  # TODO: SLOOOW, get from 1st call
+        with timer('asset_fetch'):
+            full_asset_data = get_asset(asset_url)  # TODO: SLOOOW, get from 1st call
         username = full_asset_data.get('metadata').get('user')
-        raw_data = dump_json(full_asset_data)
-        log.debug('Processing asset {0}'.format(asset_id))
+        log.debug('Processing asset {0} ({1})'.format(asset_id, username))
     except AttributeError:
         log.error('Odd looking asset received: {0}'.format(asset_data))
         raise
 
-    asset_fields = {
-        'vs_id': asset_id,
-        'raw_data': raw_data,
-        'created': timezone.now().isoformat(),
-        'deleted': None,  # In case assets were undeleted
-        'username': username,
-        'last_sync': sync_run,
-    }
-
-    # Create asset
-    asset, created = Asset.objects.update_or_create(vs_id=asset_id,
-                            defaults=asset_fields)
-
-    # Link to sites
-    sites = [full_asset_data.get('metadata').get('zonza_site', '')]
-    for site in sites:
-        # Get_or_create NOT threadsafe!!
-        try:
-            django_site = Site.objects.get(domain=site)
-        except Site.DoesNotExist:
-            try:
-                with transaction.atomic():
-                    django_site = Site.objects.create(domain=site)
-            except IntegrityError:
-                django_site = Site.objects.get(domain=site)
-
-        asset.sites.add(django_site)
-
     # Pull shapes out of each asset
-    shapes = get_shapes_for_asset(asset_id)
+    with timer('shape_fetch'):
+        shapes = get_shapes_for_asset(asset_id)
     if hasattr(shapes, 'keys'):
         shapes = (shapes,)
 
+    fetched_shapes = []
     for shape_data in shapes:
-        shape_tag = shape_data.get('tag')
-        shape_url = shape_data.get('asset')
-        shape = get_shape(shape_url)
-        shape_id = shape.get('id')
-        size = shape.get('size') or 0
-
-        shape_fields = {
-            'asset': asset,
-            'vs_id': shape_id,
-            'size': size,
-            'raw_data': dump_json(shape),
-            'version': 0,
-            'timestamp': None,
-            'shapetag': shape_tag,
-            'last_sync': sync_run,
-            'deleted': None,  # In case shape was undeleted
-        }
-
-        shape, created = Shape.objects.update_or_create(vs_id=shape_id,
-                defaults=shape_fields)
+        with timer('shape_fetch'):
+            shape = get_shape(shape_data.get('asset'))
+        fetched_shapes.append((shape_data.get('tag'), shape))
+    return asset_id, full_asset_data, fetched_shapes
+
+
+def save_assets(fetched, sync_run):
+    """Write a batch of fetched assets, their shapes and site links
+
+    Everything is written with set-based upserts inside one transaction. Raw
+    payloads go to the payload tables, only for rows whose content changed.
+
+    :param fetched:
+        A list of ``(asset_id, full_asset_data, shapes)`` from `fetch_asset`
+    """
+    now = timezone.now()
+    assets = []
+    links = []
+    shapes = []
+    asset_payloads = {}
+    shape_payloads = {}
+    for asset_id, full_asset_data, asset_shapes in fetched:
+        metadata = full_asset_data.get('metadata')
+        asset = extract.asset_columns(full_asset_data)
+        asset.update({
+            'vs_id': asset_id,
+            'content_hash': content_hash(full_asset_data),
+            'created': now,
+            'deleted': None,  # In case assets were undeleted
+            'username': metadata.get('user'),
+            'last_sync_id': sync_run.pk,
+            'last_synced': now,
+        })
+        assets.append(asset)
+        asset_payloads[asset_id] = full_asset_data
+        # Link to sites
+        sites = [metadata.get('zonza_site', '')]
+        links.extend((asset_id, site) for site in sites)
+
+        for shape_tag, shape in asset_shapes:
+            shape_fields = extract.shape_columns(shape)
+            shape_fields.update({
+                'asset_id': asset_id,  # Replaced with the pk once upserted
+                'vs_id': shape.get('id'),
+                'content_hash': content_hash(shape, shape_tag),
+                'shapetag': shape_tag,
+                'last_sync_id': sync_run.pk,
+                'last_synced': now,
+                'deleted': None,  # In case shape was undeleted
+            })
+            shapes.append(shape_fields)
+            shape_payloads[shape.get('id')] = shape
+
+    # All that changes for rows with the same content
+    touch = {'last_sync': sync_run, 'last_synced': now, 'deleted': None}
+
+    with transaction.atomic():
+        with timer('site_link'):
+            site_pks = dict((domain, get_site(domain).pk)
+                            for domain in set(site for _, site in links))
+        with timer('db_upsert'):
+            asset_pks = bulk.upsert_changed(Asset, assets, touch,
+                                            payloads=asset_payloads)
+        with timer('site_link'):
+            bulk.add_site_links((asset_pks[asset_id], site_pks[site])
+                                for asset_id, site in links)
+        for shape in shapes:
+            shape['asset_id'] = asset_pks[shape['asset_id']]
+        with timer('db_upsert'):
+            bulk.upsert_changed(Shape, shapes, touch,
+                                payloads=shape_payloads)
+    incr('assets', len(assets))
+    incr('shapes', len(shapes))
+
+
+class Checkpoint(object):
+    """Track which search pages have been completely written
+
+    Pages finish out of order when syncing concurrently, so a page only counts
+    as done once every asset on it, and on every page before it, is saved. The
+    offset the done pages reach is stored on the `SyncRun` so the sync can be
+    resumed from there.
+    """
+
+    def __init__(self, sync_run, done=0):
+        self.sync_run = sync_run
+        self.done = done  # Offset up to which every result is written
+        self.current = None  # Start of the page the search iterator is on
+        self.outstanding = defaultdict(int)  # Page start -> assets unwritten
+        self.ends = {}  # Page start -> page end
+        self.lock = threading.Lock()
+
+    def track(self, items):
+        """Wrap the search iterator, counting the assets handed out per page"""
+        for asset_data, count, page in items:
+            start, end = page
+            with self.lock:
+                self.outstanding[start] += 1
+                self.ends[start] = end
+                self.current = start
+            yield asset_data, count, page
+        with self.lock:
+            self.current = None
+
+    def saved(self, pages):
+        """Record that one asset from each of ``pages`` has been written"""
+        with self.lock:
+            for start, end in pages:
+                self.outstanding[start] -= 1
+            self.advance()
+
+    def advance(self):
+        while (self.done in self.outstanding and
+               not self.outstanding[self.done] and
+               (self.current is None or self.done < self.current)):
+            del self.outstanding[self.done]
+            self.done = self.ends.pop(self.done)
+        if self.done > self.sync_run.checkpoint:
+            self.sync_run.checkpoint = self.done
+            SyncRun.objects.filter(pk=self.sync_run.pk) \
+                           .update(checkpoint=self.done)
+
+
+class BatchWriter(object):
+    """Collect fetched assets and save them ``batch_size`` at a time
+
+    Thread-safe; whichever worker fills up the batch writes it, so concurrent
+    workers also write concurrently.
+
+    :param close_connection:
+        Close the thread's DB connection after each write. Set when sites are
+        synced at the same time, as each has its own pool of worker threads
+        and holding a connection in every one of them would open far more
+        than there are workers writing
+    """
+
+    def __init__(self, sync_run, checkpoint, batch_size=PER_PAGE,
+                 close_connection=False):
+        self.sync_run = sync_run
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.close_connection = close_connection
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def add(self, fetched, page):
+        with self.lock:
+            self.pending.append((fetched, page))
+            if len(self.pending) < self.batch_size:
+                return
+            batch, self.pending = self.pending, []
+        self.save(batch)
+
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, []
+        self.save(batch)
+
+    def save(self, batch):
+        try:
+            if batch:
+                save_assets([fetched for fetched, page in batch],
+                            self.sync_run)
+            self.checkpoint.saved([page for fetched, page in batch])
+        finally:
+            if self.close_connection:
+                connection.close()
 
 
 class Command(BaseCommand):
@@ -129,8 +387,13 @@ class Command(BaseCommand):
             '-d',
             '--delay',
             dest='delay',
-            help='Delay each Vidispine search call by this '
-                 'number of seconds. Default is 2'),
+            help='Wait at least this number of seconds between API calls. '
+                 'Shorthand for --rate 1/DELAY'),
+        make_option(
+            '--rate',
+            dest='rate',
+            help='Maximum number of API calls per second. Defaults to '
+                 'settings.BORK_RATE_LIMIT (unlimited)'),
         make_option(
             '-s',
             '--skip',
@@ -140,55 +403,235 @@ class Command(BaseCommand):
             '-z',
             '--zonza',
             dest='zonza_site',
-            help='Which zonza_site to sync/filter by'),
+            help='Which zonza_site to sync/filter by. Separate several sites '
+                 'with commas to sync them at the same time'),
+        make_option(
+            '-a',
+            '--all-sites',
+            action='store_true',
+            dest='all_sites',
+            default=False,
+            help='Sync every known site at the same time'),
+        make_option(
+            '-p',
+            '--parallel-sites',
+            dest='parallel_sites',
+            help='Maximum number of sites synced at the same time. Workers are '
+                 'shared fairly between them. Default is 4'),
+        make_option(
+            '-w',
+            '--workers',
+            dest='workers',
+            help='Number of assets to fetch and save concurrently (in total, '
+                 'when syncing several sites). Default is 1'),
+        make_option(
+            '-b',
+            '--batch-size',
+            dest='batch_size',
+            help='Number of assets written to the database per transaction. '
+                 'Default is {0}'.format(PER_PAGE)),
+        make_option(
+            '--per-page',
+            dest='per_page',
+            help='Number of results per search page. Default is {0}'.format(
+                PER_PAGE)),
+        make_option(
+            '--auto-page-size',
+            action='store_true',
+            dest='auto_page_size',
+            default=False,
+            help='Grow the search page size (from --per-page, up to '
+                 'settings.SYNC_MAX_PER_PAGE) while searches are quick'),
+        make_option(
+            '--prefetch',
+            dest='prefetch',
+            help='Number of search pages fetched in the background ahead of '
+                 'the workers, 0 to disable. Defaults to '
+                 'settings.SYNC_PREFETCH_PAGES (2)'),
+        make_option(
+            '--no-cache',
+            action='store_true',
+            dest='no_cache',
+            default=False,
+            help="Don't use or update the on-disk cache of asset and shape "
+                 "responses"),
+        make_option(
+            '-r',
+            '--resume',
+            dest='resume',
+            help='Resume an interrupted sync from its last checkpoint, given '
+                 'its sync UUID'),
+        make_option(
+            '-i',
+            '--incremental',
+            action='store_true',
+            dest='incremental',
+            default=False,
+            help='Only sync items changed since the last completed sync of '
+                 'the site. Deleted items are not detected, so run a full '
+                 'sync periodically'),
     )
 
+    def start_sync_run(self, domain, incremental=False):
+        current_site, created = Site.objects.get_or_create(domain=domain)
+        changed_since = None
+        if incremental:
+            changed_since = SyncRun.last_high_water_mark(current_site)
+            if not changed_since:
+                print "No completed sync of {0} to continue from, " \
+                      "syncing everything".format(domain)
+        return SyncRun.objects.create(sync_uuid=uuid.uuid4().hex,
+                                      site=current_site,
+                                      incremental=bool(changed_since),
+                                      changed_since=changed_since,
+                                      high_water_mark=timezone.now())
+
+    def resume_sync_run(self, sync_uuid):
+        try:
+            sync_run = SyncRun.objects.get(sync_uuid=sync_uuid)
+        except SyncRun.DoesNotExist:
+            raise CommandError('No sync with UUID {0}'.format(sync_uuid))
+        if sync_run.completed:
+            raise CommandError('Sync {0} already completed'.format(sync_uuid))
+        return sync_run
+
+    def get_domains(self, options):
+        if options.get('all_sites'):
+            # Assets without a zonza_site are linked to a blank site, which
+            # can't be searched for
+            return list(Site.objects.exclude(domain='')
+                                    .order_by('domain')
+                                    .values_list('domain', flat=True))
+        zonza_sites = options.get('zonza_site') or '230pas.zonza.tv'
+        return [domain.strip() for domain in zonza_sites.split(',')
+                if domain.strip()]
+
     def handle(self, *args, **options):
-        delay = options.get('delay')
-        if delay == None:
-            delay = 0
-        delay = int(delay)
+        delay = float(options.get('delay') or 0)
+        rate = float(options.get('rate') or 0)
+        if delay:
+            rate = min(rate or 1 / delay, 1 / delay)
+        if rate:
+            client.limiter.set_rate(rate)
+        if options.get('no_cache'):
+            client.cache = None
         skip = int(options.get('skip') or 0)
-        sync_uuid = uuid.uuid4().hex
-        global sync_run
-        ZONZA_SITES = ['trials', '230pas', 'zonzacompany']
-        zonza_site = delay = options.get('zonza_site') or '230pas.zonza.tv'
-        current_site, created = Site.objects.get_or_create(domain=zonza_site)
-        sync_run = SyncRun.objects.create(sync_uuid=sync_uuid, site=current_site)
-
-        done = 0
+        workers = max(int(options.get('workers') or 1), 1)
+        batch_size = max(int(options.get('batch_size') or PER_PAGE), 1)
+        self.per_page = max(int(options.get('per_page') or PER_PAGE), 1)
+        self.auto_tune = options.get('auto_page_size')
+        self.prefetch = options.get('prefetch')
+        if self.prefetch is not None:
+            self.prefetch = max(int(self.prefetch), 0)
+        parallel_sites = max(int(options.get('parallel_sites') or 4), 1)
+
+        if options.get('resume'):
+            if skip:
+                raise CommandError('--skip can not be used with --resume')
+            sync_runs = [self.resume_sync_run(options['resume'])]
+        else:
+            domains = self.get_domains(options)
+            if skip and len(domains) > 1:
+                raise CommandError('--skip can only be used with a single site')
+            sync_runs = [self.start_sync_run(domain, options.get('incremental'))
+                         for domain in domains]
+
         print "Started at {0}".format(timezone.now().isoformat())
-        print "Sync UUID is {0}".format(sync_uuid)
-        print "Syncing assets and shapes..."
+        for sync_run in sync_runs:
+            print "Sync UUID for {0} is {1}".format(sync_run.site.domain,
+                                                    sync_run.sync_uuid)
+        print "Syncing assets and shapes with {0} worker(s)...".format(workers)
+
+        if len(sync_runs) == 1:
+            self.sync_site(sync_runs[0], skip, workers, batch_size,
+                           resume=bool(options.get('resume')))
+            print "\n...Done!"
+            return
+
+        # Sites are synced side by side, all sharing the same worker slots
+        slots = FairSemaphore(workers)
+        failed = []
+
+        def sync_site(sync_run):
+            try:
+                self.sync_site(sync_run, 0, workers, batch_size, slots=slots,
+                               label='{0} '.format(sync_run.site.domain))
+            except Exception:
+                log.exception('Sync of {0} failed'.format(sync_run.site.domain))
+                failed.append(sync_run)
+
+        run_concurrently(sync_site, sync_runs,
+                         min(parallel_sites, len(sync_runs)))
+
+        if failed:
+            raise CommandError('Sync failed for {0}'.format(', '.join(
+                '{0} ({1})'.format(sync_run.site.domain, sync_run.sync_uuid)
+                for sync_run in failed)))
+        print "...Done!"
+
+    def sync_site(self, sync_run, skip, workers, batch_size, resume=False,
+                  slots=None, label=''):
+        """Sync every asset of ``sync_run.site`` then sweep for deletions
+
+        :param slots:
+            A `FairSemaphore` shared with other sites being synced at the same
+            time, held while each asset is synced
+        """
+        zonza_site = sync_run.site.domain
+        changed_since = sync_run.changed_since
+
+        if resume:
+            # Redo the last checkpointed page in case results shifted since
+            skip = max(sync_run.checkpoint - self.per_page, 0)
+            print "Resuming {0} from search result {1}".format(zonza_site, skip)
+        if changed_since:
+            print "Only syncing changes to {0} since {1}".format(
+                zonza_site, changed_since.isoformat())
+
+        progress = Progress(label, lines=bool(slots))
+        metrics = SyncMetrics()
+        metrics.bind()
+        checkpoint = Checkpoint(sync_run, skip - skip % self.per_page)
+        writer = BatchWriter(sync_run, checkpoint, batch_size,
+                             close_connection=bool(slots) and workers > 1)
+
+        def sync_asset(item):
+            asset_data, count, page = item
+            metrics.bind()
+            if slots:
+                with slots:
+                    writer.add(fetch_asset(asset_data), page)
+            else:
+                writer.add(fetch_asset(asset_data), page)
+            ## Report live progress
+            progress.increment(count)
 
         try:
-            pool = ThreadPool(10) # Sets the pool size
-            assets = asset_iterator(zonza_site, skip)
-            #results = pool.map(process_single_asset, assets, 2)
-
             # Search all assets in API
-            for asset_data, count in assets:
-
-                process_single_asset(asset_data)
-
-                ## Check for assets that do not appear in API (i.e. have been deleted)
-                ## Use some kind of flag in the db to delete anything not found in
-                ## this run
-
-                ## Report live progress
-                done += 1
-                update_progress(done, count)
+            assets = checkpoint.track(asset_iterator(
+                zonza_site, skip, changed_since, per_page=self.per_page,
+                prefetch=self.prefetch, auto_tune=self.auto_tune,
+                metrics=metrics))
+            if workers > 1:
+                run_concurrently(sync_asset, assets, workers)
+            else:
+                for asset in assets:
+                    sync_asset(asset)
+            writer.flush()
         finally:
-            #pool.close()
-            #pool.join()
             sync_run.end_time=timezone.now()
-            sync_run.save()
-            pass
+            sync_run.stats = metrics.summary()
+            sync_run.save(update_fields=['end_time', 'stats'])
 
-        # 'Delete' any reportable models not containing current sync_guid
-        delete_not_synced(Asset, sync_run)
-        delete_not_synced(Shape, sync_run)
+        ## Check for assets that do not appear in API (i.e. have been deleted)
+        # 'Delete' any reportable models not containing current sync_guid.
+        # Incremental runs only see changed items so can't tell what's gone
+        if not sync_run.incremental:
+            sync_run.deleted_assets = delete_not_synced(Asset, sync_run)
+            sync_run.deleted_shapes = delete_not_synced(Shape, sync_run)
 
         sync_run.completed=True
-        sync_run.save()
-        print "\n...Done!"
+        sync_run.stats = metrics.summary()
+        sync_run.save(update_fields=['completed', 'deleted_assets',
+                                     'deleted_shapes', 'stats'])
+        log.info('Sync of {0} finished: {1}'.format(zonza_site, sync_run.stats))
@@ -0,0 +1,121 @@
+"""Counters and latency histograms for the sync pipeline
+
+A `SyncMetrics` is bound to each thread working on a sync, so code deep in the
+pipeline (e.g. the API client) can record against the right run through the
+module level `timer` and `incr` without it being passed around.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+# Stages of the sync, in pipeline order
+STAGES = ('search', 'asset_fetch', 'shape_fetch', 'db_upsert', 'site_link',
+          'deletion_sweep')
+
+# Upper bounds (seconds) of the histogram buckets, 1ms to ~5 minutes
+BUCKETS = [0.001 * 1.25 ** power for power in range(57)]
+
+_local = threading.local()
+
+
+class Histogram(object):
+    """Latencies counted into fixed exponential buckets
+
+    Percentiles are approximate (the upper bound of the bucket they fall in)
+    but memory doesn't grow with the number of samples.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        if not self.count:
+            return None
+        wanted = self.count * percent / 100.0
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted:
+                break
+        if index < len(BUCKETS):
+            return min(BUCKETS[index], self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'total': round(self.total, 3),
+            'p50': round(self.percentile(50) or 0, 4),
+            'p95': round(self.percentile(95) or 0, 4),
+            'max': round(self.max, 4),
+        }
+
+
+class SyncMetrics(object):
+    """Thread-safe timings and counters for one `SyncRun`"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.histograms = defaultdict(Histogram)
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def bind(self):
+        """Record anything the calling thread measures against this run"""
+        _local.metrics = self
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.histograms[stage].observe(seconds)
+
+    def incr(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def summary(self):
+        """A JSON serialisable summary, as stored on `SyncRun.stats`"""
+        with self.lock:
+            elapsed = time.time() - self.started
+            assets = self.counters.get('assets', 0)
+            return {
+                'elapsed': round(elapsed, 1),
+                'assets_per_second': round(assets / elapsed, 2) if elapsed else 0,
+                'stages': dict((stage, histogram.summary()) for stage, histogram
+                               in self.histograms.items()),
+                'counters': dict(self.counters),
+            }
+
+
+def current():
+    """The metrics bound to the calling thread, if any"""
+    return getattr(_local, 'metrics', None)
+
+
+@contextmanager
+def timer(stage):
+    """Time the block against ``stage`` of the bound metrics"""
+    started = time.time()
+    try:
+        yield
+    finally:
+        metrics = current()
+        if metrics is not None:
+            metrics.observe(stage, time.time() - started)
+
+
+def incr(name, amount=1):
+    metrics = current()
+    if metrics is not None:
+        metrics.incr(name, amount)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.contrib.sites.models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Site',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('domain', models.CharField(unique=True, max_length=100, verbose_name='domain name', validators=[django.contrib.sites.models._simple_domain_name_validator])),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('start_time', models.DateTimeField(auto_now=True)),
+                ('end_time', models.DateTimeField(null=True, blank=True)),
+                ('sync_uuid', models.CharField(max_length=32)),
+                ('completed', models.BooleanField(default=False)),
+                ('site', models.ForeignKey(to='reporting.Site')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='Asset',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('last_synced', models.DateTimeField(auto_now=True)),
+                ('deleted', models.DateTimeField(null=True, blank=True)),
+                ('vs_id', models.CharField(unique=True, max_length=10)),
+                ('filename', models.CharField(max_length=255, null=True, blank=True)),
+                ('username', models.CharField(max_length=255)),
+                ('created', models.DateTimeField()),
+                ('raw_data', jsonfield.fields.JSONField()),
+                ('last_sync', models.ForeignKey(to='reporting.SyncRun')),
+                ('sites', models.ManyToManyField(to='reporting.Site')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='Shape',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('last_synced', models.DateTimeField(auto_now=True)),
+                ('deleted', models.DateTimeField(null=True, blank=True)),
+                ('vs_id', models.CharField(unique=True, max_length=10)),
+                ('shapetag', models.CharField(max_length=255)),
+                ('timestamp', models.DateTimeField(null=True, blank=True)),
+                ('size', models.BigIntegerField()),
+                ('version', models.IntegerField()),
+                ('raw_data', jsonfield.fields.JSONField()),
+                ('asset', models.ForeignKey(to='reporting.Asset')),
+                ('last_sync', models.ForeignKey(to='reporting.SyncRun')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='Download',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('last_synced', models.DateTimeField(auto_now=True)),
+                ('when', models.DateTimeField(auto_now_add=True)),
+                ('username', models.CharField(max_length=255)),
+                ('item', models.ForeignKey(to='reporting.Asset')),
+                ('last_sync', models.ForeignKey(to='reporting.SyncRun')),
+                ('shape', models.ForeignKey(to='reporting.Shape')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model,),
+        ),
+    ]
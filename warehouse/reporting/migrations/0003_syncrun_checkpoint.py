@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0002_syncrun_incremental'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncrun',
+            name='checkpoint',
+            field=models.IntegerField(default=0),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0003_syncrun_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='asset',
+            name='content_hash',
+            field=models.CharField(default='', max_length=40, blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='shape',
+            name='content_hash',
+            field=models.CharField(default='', max_length=40, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0004_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncrun',
+            name='deleted_assets',
+            field=models.IntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='syncrun',
+            name='deleted_shapes',
+            field=models.IntegerField(default=0),
+            preserve_default=True,
+        ),
+        # Let the deletion sweep walk one site's assets and their live shapes
+        # without touching the rest of the tables. Assets are then looked up
+        # by primary key, which needs no index of its own
+        migrations.RunSQL(
+            'CREATE INDEX reporting_asset_sites_site_asset '
+            'ON reporting_asset_sites (site_id, asset_id)',
+            'DROP INDEX reporting_asset_sites_site_asset'),
+        migrations.RunSQL(
+            'CREATE INDEX reporting_shape_live_asset '
+            'ON reporting_shape (asset_id, last_sync_id) WHERE deleted IS NULL',
+            'DROP INDEX reporting_shape_live_asset'),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0005_deletion_sweep'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncrun',
+            name='stats',
+            field=jsonfield.fields.JSONField(null=True, blank=True),
+            preserve_default=True,
+        ),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import reporting.fields
+
+
+def to_jsonb(table):
+    return migrations.RunSQL(
+        'ALTER TABLE {0} ALTER COLUMN raw_data TYPE jsonb '
+        'USING raw_data::jsonb'.format(table),
+        'ALTER TABLE {0} ALTER COLUMN raw_data TYPE text '
+        'USING raw_data::text'.format(table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0006_syncrun_stats'),
+    ]
+
+    operations = [
+        # The existing text needs an explicit cast, which AlterField won't do
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                to_jsonb('reporting_asset'),
+                to_jsonb('reporting_shape'),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='asset',
+                    name='raw_data',
+                    field=reporting.fields.JSONBField(),
+                    preserve_default=True,
+                ),
+                migrations.AlterField(
+                    model_name='shape',
+                    name='raw_data',
+                    field=reporting.fields.JSONBField(),
+                    preserve_default=True,
+                ),
+            ],
+        ),
+        # Metadata reported on, matching raw_data__metadata__<key> lookups
+        migrations.RunSQL(
+            "CREATE INDEX reporting_asset_zonza_site "
+            "ON reporting_asset ((raw_data -> 'metadata' ->> 'zonza_site'))",
+            'DROP INDEX reporting_asset_zonza_site'),
+        migrations.RunSQL(
+            "CREATE INDEX reporting_asset_trials_category "
+            "ON reporting_asset ((raw_data -> 'metadata' ->> 'trials_category'))",
+            'DROP INDEX reporting_asset_trials_category'),
+        # Any other metadata, through raw_data__contains
+        migrations.RunSQL(
+            'CREATE INDEX reporting_asset_raw_data '
+            'ON reporting_asset USING gin (raw_data jsonb_path_ops)',
+            'DROP INDEX reporting_asset_raw_data'),
+    ]
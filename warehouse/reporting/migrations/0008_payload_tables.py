@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import reporting.fields
+
+
+def copy_payloads(model, owner):
+    return migrations.RunSQL(
+        'INSERT INTO reporting_{0}payload ({1}_id, raw_data) '
+        'SELECT id, raw_data FROM reporting_{0}'.format(model, owner),
+        'UPDATE reporting_{0} AS t SET raw_data = p.raw_data '
+        'FROM reporting_{0}payload AS p WHERE p.{1}_id = t.id'.format(
+            model, owner))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0007_jsonb_raw_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetPayload',
+            fields=[
+                ('asset', models.OneToOneField(related_name='payload', primary_key=True, serialize=False, to='reporting.Asset')),
+                ('raw_data', reporting.fields.JSONBField()),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='ShapePayload',
+            fields=[
+                ('shape', models.OneToOneField(related_name='payload', primary_key=True, serialize=False, to='reporting.Shape')),
+                ('raw_data', reporting.fields.JSONBField()),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        # Nullable while the payloads move, so the columns can be added back
+        # empty (and filled by copy_payloads) when migrating backwards
+        migrations.AlterField(
+            model_name='asset',
+            name='raw_data',
+            field=reporting.fields.JSONBField(null=True),
+            preserve_default=True,
+        ),
+        migrations.AlterField(
+            model_name='shape',
+            name='raw_data',
+            field=reporting.fields.JSONBField(null=True),
+            preserve_default=True,
+        ),
+        copy_payloads('asset', 'asset'),
+        copy_payloads('shape', 'shape'),
+        # The metadata indexes move with the payloads
+        migrations.RunSQL(
+            "CREATE INDEX reporting_assetpayload_zonza_site "
+            "ON reporting_assetpayload "
+            "((raw_data -> 'metadata' ->> 'zonza_site'))",
+            'DROP INDEX reporting_assetpayload_zonza_site'),
+        migrations.RunSQL(
+            "CREATE INDEX reporting_assetpayload_trials_category "
+            "ON reporting_assetpayload "
+            "((raw_data -> 'metadata' ->> 'trials_category'))",
+            'DROP INDEX reporting_assetpayload_trials_category'),
+        migrations.RunSQL(
+            'CREATE INDEX reporting_assetpayload_raw_data '
+            'ON reporting_assetpayload USING gin (raw_data jsonb_path_ops)',
+            'DROP INDEX reporting_assetpayload_raw_data'),
+        # The indexes of 0007 go with the columns, and come back with them
+        # when migrating backwards
+        migrations.RunSQL(
+            'DROP INDEX reporting_asset_zonza_site; '
+            'DROP INDEX reporting_asset_trials_category; '
+            'DROP INDEX reporting_asset_raw_data',
+            "CREATE INDEX reporting_asset_zonza_site "
+            "ON reporting_asset ((raw_data -> 'metadata' ->> 'zonza_site')); "
+            "CREATE INDEX reporting_asset_trials_category "
+            "ON reporting_asset "
+            "((raw_data -> 'metadata' ->> 'trials_category')); "
+            'CREATE INDEX reporting_asset_raw_data '
+            'ON reporting_asset USING gin (raw_data jsonb_path_ops)'),
+        migrations.RemoveField(
+            model_name='asset',
+            name='raw_data',
+        ),
+        migrations.RemoveField(
+            model_name='shape',
+            name='raw_data',
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0008_payload_tables'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('kind', models.CharField(max_length=20)),
+                ('params', jsonfield.fields.JSONField(default=dict, blank=True)),
+                ('status', models.CharField(default='queued', max_length=10, db_index=True, choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')])),
+                ('progress', models.FloatField(null=True, blank=True)),
+                ('message', models.TextField(default='', blank=True)),
+                ('result', models.CharField(default='', max_length=255, blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True, blank=True)),
+                ('finished', models.DateTimeField(null=True, blank=True)),
+                ('heartbeat', models.DateTimeField(null=True, blank=True)),
+                ('worker', models.CharField(default='', max_length=100, blank=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
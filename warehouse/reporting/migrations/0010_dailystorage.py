@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0009_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStorage',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('date', models.DateField(db_index=True)),
+                ('shapetag', models.CharField(max_length=255)),
+                ('username', models.CharField(max_length=255)),
+                ('bytes', models.BigIntegerField(default=0)),
+                ('shapes', models.IntegerField(default=0)),
+                ('assets', models.IntegerField(default=0)),
+                ('ingests', models.IntegerField(default=0)),
+                ('site', models.ForeignKey(to='reporting.Site')),
+            ],
+            options={
+                'verbose_name_plural': 'daily storage',
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterUniqueTogether(
+            name='dailystorage',
+            unique_together=set([('site', 'date', 'shapetag', 'username')]),
+        ),
+    ]
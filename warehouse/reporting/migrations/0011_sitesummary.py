@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0010_dailystorage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SiteSummary',
+            fields=[
+                ('site', models.OneToOneField(related_name='summary', primary_key=True, serialize=False, to='reporting.Site')),
+                ('transcodes', models.IntegerField(default=0)),
+                ('size', models.BigIntegerField(default=0)),
+                ('assets', models.IntegerField(default=0)),
+                ('uploaders', models.IntegerField(default=0)),
+                ('top_uploaders', jsonfield.fields.JSONField(default=list, blank=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'site summaries',
+            },
+            bases=(models.Model,),
+        ),
+    ]
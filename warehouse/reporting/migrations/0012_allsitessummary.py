@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reporting', '0011_sitesummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllSitesSummary',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('transcodes', models.IntegerField(default=0)),
+                ('size', models.BigIntegerField(default=0)),
+                ('assets', models.IntegerField(default=0)),
+                ('uploaders', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'all sites summary',
+            },
+            bases=(models.Model,),
+        ),
+    ]
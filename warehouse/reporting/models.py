@@ -1,26 +1,43 @@
 import os
+import sys
 import time
+import Queue
 import logging
-import requests
+import threading
 import jsonfield
 import json
+import hashlib
+from datetime import datetime, timedelta
 
-from retrying import retry
-
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.conf import settings
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ImproperlyConfigured, ObjectDoesNotExist
 from django.contrib.sites.models import _simple_domain_name_validator
+from django.utils import timezone
 
 from dateutil import parser
 
+from reporting.cache import ReportCache
+from reporting.client import client
+from reporting.fields import JSONBField
+from reporting.metrics import STAGES, timer
+
 
 log = logging.getLogger(__name__)
 
-PER_PAGE = 100
+PER_PAGE = getattr(settings, 'SYNC_PER_PAGE', 100)
 PAGE_TOKEN = '__page'
 LIMIT_TOKEN = '__page_size'
 
+_END = object()
+
+# Generated reports, kept until a sync of their site completes
+report_cache = ReportCache(getattr(settings, 'REPORT_CACHE_DIR', None),
+                           getattr(settings, 'REPORT_CACHE_MAX_SIZE',
+                                   1024 ** 3))
+
 def load_json(raw):
     """for debugging"""
     try:
@@ -38,14 +55,14 @@ def dump_json(obj):
         raise
 
 
-@retry(stop_max_attempt_number=3, wait_exponential_multiplier=1000, wait_exponential_max=10000)
-def GET(url, **kwargs):
-    result = requests.get(url, **kwargs)
-    log.debug('HTTP Request performed to: {0} [status: {1}]'.format(url, result.status_code))
-    if int(result.status_code) == 500:
-        log.debug('warning status {0}'.format(result.status_code))
-        raise Exception('Unable to retrieve data')
-    return result
+def content_hash(*parts):
+    """Stable hash of JSON serialisable data, to tell when a payload changed"""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+
+
+def GET(url, params=None):
+    """Perform a GET through the shared, pooled API client"""
+    return client.get(url, params=params)
 
 
 class Site(models.Model):
@@ -63,16 +80,92 @@ class Site(models.Model):
 
 
 class SyncRun(models.Model):
-    """Track each sync"""
+    """Track each sync
+
+    ``high_water_mark`` is the time the sync started searching. Once the run
+    has completed, every change made before it has been synced, so an
+    incremental run only needs to ask for items changed since then.
+
+    ``checkpoint`` is the number of search results, from the start of the
+    search, which have been completely written. An interrupted run can be
+    resumed from there.
+
+    ``deleted_assets`` and ``deleted_shapes`` count the rows the run marked as
+    deleted because they were no longer found.
+
+    ``stats`` holds the run's `SyncMetrics` summary: throughput, timings per
+    stage and HTTP counters.
+    """
     start_time = models.DateTimeField(auto_now=True)
     end_time = models.DateTimeField(blank=True, null=True)
     sync_uuid = models.CharField(max_length=32)
     completed = models.BooleanField(default=False)
     site = models.ForeignKey('reporting.Site')
+    incremental = models.BooleanField(default=False)
+    changed_since = models.DateTimeField(blank=True, null=True)
+    high_water_mark = models.DateTimeField(blank=True, null=True)
+    checkpoint = models.IntegerField(default=0)
+    deleted_assets = models.IntegerField(default=0)
+    deleted_shapes = models.IntegerField(default=0)
+    stats = jsonfield.JSONField(blank=True, null=True)
 
     def __unicode__(self):
         return self.sync_uuid
 
+    @classmethod
+    def last_high_water_mark(cls, site):
+        """Return the mark of the latest completed sync for ``site`` (if any)"""
+        last_run = cls.objects.filter(site=site, completed=True,
+                                      high_water_mark__isnull=False) \
+                              .order_by('-high_water_mark').first()
+        return last_run and last_run.high_water_mark
+
+    @property
+    def assets_per_second(self):
+        return (self.stats or {}).get('assets_per_second')
+
+    def stage_timings(self):
+        """``(stage, summary)`` for each timed stage, in pipeline order"""
+        stages = (self.stats or {}).get('stages', {})
+        return [(stage, stages[stage]) for stage in STAGES if stage in stages]
+
+
+@receiver(post_save, sender=SyncRun)
+def invalidate_reports(sender, instance, update_fields=None, **kwargs):
+    """Drop cached reports of the site once a sync of it completes"""
+    if instance.completed and (update_fields is None or
+                               'completed' in update_fields):
+        report_cache.invalidate(instance.site.domain)
+
+
+@receiver(post_save, sender=SyncRun)
+def snapshot_storage(sender, instance, update_fields=None, **kwargs):
+    """Bring today's `DailyStorage` rows of the site up to date once a sync of
+    it completes"""
+    if instance.completed and (update_fields is None or
+                               'completed' in update_fields):
+        try:
+            DailyStorage.catch_up(instance.site)
+        except Exception:
+            # The sync itself went fine, ``rollup_storage`` can catch up later
+            log.exception('Storage snapshot of {0} failed'.format(
+                instance.site.domain))
+
+
+@receiver(post_save, sender=SyncRun)
+def summarise_site(sender, instance, update_fields=None, **kwargs):
+    """Recount the `SiteSummary` of the site, and the `AllSitesSummary`, once
+    a sync of it completes"""
+    if instance.completed and (update_fields is None or
+                               'completed' in update_fields):
+        try:
+            SiteSummary.refresh(instance.site)
+            AllSitesSummary.refresh()
+        except Exception:
+            # Views recount sites without a summary themselves
+            log.exception('Summary of {0} failed'.format(
+                instance.site.domain))
+
 
 class DamAssetManager(models.Manager):
 
@@ -88,7 +181,18 @@ class ReportableModelMixin(models.Model):
         abstract = True
 
 
-class Asset(ReportableModelMixin):
+class PayloadMixin(object):
+    """Lazy access to the raw API payload kept in the model's side table"""
+
+    @property
+    def raw_data(self):
+        try:
+            return self.payload.raw_data
+        except ObjectDoesNotExist:
+            return None
+
+
+class Asset(PayloadMixin, ReportableModelMixin):
     """A local cache record of an asset in Vidispine"""
     objects = models.Manager()
     vidispine_objects = DamAssetManager()
@@ -98,7 +202,8 @@ class Asset(ReportableModelMixin):
     username = models.CharField(max_length=255)
     created = models.DateTimeField()
     sites = models.ManyToManyField('reporting.Site')
-    raw_data = jsonfield.JSONField()
+    # Hash of the synced payload, rows are only rewritten when it changes
+    content_hash = models.CharField(max_length=40, blank=True, default='')
 
     def __unicode__(self):
         return u'{} - {} ({})'.format(self.vs_id, self.filename, self.username)
@@ -118,7 +223,7 @@ class Download(ReportableModelMixin):
     shape = models.ForeignKey('reporting.Shape')
 
 
-class Shape(ReportableModelMixin):
+class Shape(PayloadMixin, ReportableModelMixin):
     """A record of a Vidispine shape"""
     deleted = models.DateTimeField(blank=True, null=True)
     asset = models.ForeignKey('reporting.Asset')
@@ -127,102 +232,537 @@ class Shape(ReportableModelMixin):
     timestamp = models.DateTimeField(blank=True, null=True)
     size = models.BigIntegerField()
     version = models.IntegerField()
-    raw_data = jsonfield.JSONField()
+    # Hash of the synced payload, see `Asset.content_hash`
+    content_hash = models.CharField(max_length=40, blank=True, default='')
 
     def __unicode__(self):
         return u'{} - {} (version {})'.format(self.vs_id, self.shapetag, self.version)
 
 
+class AssetPayload(models.Model):
+    """The raw API payload of an `Asset`
+
+    Kept out of the asset table so scans of the reporting columns only read
+    narrow rows. Postgres compresses it out of line once it's over ~2KB.
+    """
+    asset = models.OneToOneField('reporting.Asset', primary_key=True,
+                                 related_name='payload')
+    raw_data = JSONBField()
+
+
+class ShapePayload(models.Model):
+    """The raw API payload of a `Shape`, see `AssetPayload`"""
+    shape = models.OneToOneField('reporting.Shape', primary_key=True,
+                                 related_name='payload')
+    raw_data = JSONBField()
+
+
+class Job(models.Model):
+    """A report or sync run in the background by the ``run_jobs`` workers
+
+    Jobs are queued in the database so no broker is needed. ``progress`` is
+    the fraction done, if known, and ``result`` the path of the file the job
+    produced, if any. Workers keep ``heartbeat`` up to date while a job runs so
+    jobs of workers which died can be queued again.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    kind = models.CharField(max_length=20)
+    params = jsonfield.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED,
+                              db_index=True)
+    progress = models.FloatField(blank=True, null=True)
+    message = models.TextField(blank=True, default='')
+    result = models.CharField(max_length=255, blank=True, default='')
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    heartbeat = models.DateTimeField(blank=True, null=True)
+    worker = models.CharField(max_length=100, blank=True, default='')
+
+    def __unicode__(self):
+        return u'{0} {1} ({2})'.format(self.kind, self.pk, self.status)
+
+    @classmethod
+    def enqueue(cls, kind, **params):
+        return cls.objects.create(kind=kind, params=params)
+
+    @classmethod
+    def claim(cls, worker):
+        """Take the oldest queued job for ``worker``, or return None"""
+        now = timezone.now()
+        # Workers skip the jobs others are claiming instead of waiting
+        qn = connection.ops.quote_name
+        sql = ('UPDATE {table} SET {status} = %s, {started} = %s, '
+               '{heartbeat} = %s, {worker} = %s '
+               'WHERE id = (SELECT id FROM {table} WHERE {status} = %s '
+               'ORDER BY {created}, id LIMIT 1 FOR UPDATE SKIP LOCKED) '
+               'RETURNING id').format(
+            table=qn(cls._meta.db_table),
+            **dict((name, qn(cls._meta.get_field(name).column))
+                   for name in ('status', 'started', 'heartbeat', 'worker',
+                                'created')))
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute(sql, [cls.RUNNING, now, now, worker, cls.QUEUED])
+            row = cursor.fetchone()
+        return row and cls.objects.get(pk=row[0])
+
+    @classmethod
+    def requeue_stale(cls, seconds):
+        """Queue again running jobs whose worker hasn't been heard from in
+        ``seconds``
+
+        :returns:
+            The number of jobs queued again
+        """
+        stale = timezone.now() - timedelta(seconds=seconds)
+        return cls.objects.filter(status=cls.RUNNING, heartbeat__lt=stale) \
+                          .update(status=cls.QUEUED, worker='')
+
+    def beat(self):
+        self.heartbeat = timezone.now()
+        Job.objects.filter(pk=self.pk).update(heartbeat=self.heartbeat)
+
+    def set_progress(self, done, total):
+        self.progress = float(done) / total if total else None
+        self.heartbeat = timezone.now()
+        Job.objects.filter(pk=self.pk).update(progress=self.progress,
+                                              heartbeat=self.heartbeat)
+
+    def finish(self, result='', message=''):
+        self.status = self.DONE
+        self.progress = 1.0
+        self.result = result
+        self.message = message
+        self.finished = timezone.now()
+        self.save(update_fields=['status', 'progress', 'result', 'message',
+                                 'finished'])
+
+    def fail(self, message):
+        self.status = self.FAILED
+        self.message = message
+        self.finished = timezone.now()
+        self.save(update_fields=['status', 'message', 'finished'])
+
+    @property
+    def is_finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+
+class DailyStorage(models.Model):
+    """Storage of each site by day, shape tag and uploader
+
+    A compact rollup of the asset and shape tables for charting over time.
+    Each row holds, as at the end of ``date``, the ``bytes`` and number of
+    ``shapes`` of that tag which weren't deleted, the ``assets`` they belong
+    to and the ``ingests``: those of the assets created that day.
+
+    ``assets`` and ``ingests`` are counted per shape tag, so an asset with
+    several tags counts once for each. Filter on one tag (e.g. ``original``)
+    when counting assets across tags.
+
+    Today's rows of a site are refreshed when a sync of it completes (along
+    with any days since its last snapshot), earlier days keep what the last
+    sync of that day saw. ``rollup_storage`` rebuilds
+    past days from the created and deleted dates.
+    """
+    date = models.DateField(db_index=True)
+    site = models.ForeignKey('reporting.Site')
+    shapetag = models.CharField(max_length=255)
+    username = models.CharField(max_length=255)
+    bytes = models.BigIntegerField(default=0)
+    shapes = models.IntegerField(default=0)
+    assets = models.IntegerField(default=0)
+    ingests = models.IntegerField(default=0)
+
+    # Fields totalled by `series`
+    TOTALS = ('bytes', 'shapes', 'assets', 'ingests')
+
+    class Meta:
+        unique_together = ('site', 'date', 'shapetag', 'username')
+        verbose_name_plural = 'daily storage'
+
+    def __unicode__(self):
+        return u'{0} {1} {2} {3}'.format(self.date, self.site_id,
+                                         self.shapetag, self.username)
+
+    @classmethod
+    def snapshot(cls, site, date=None):
+        """Replace the rows of ``site`` for ``date`` (default today) with the
+        storage as at the end of that day
+
+        :returns:
+            The number of rows written
+        """
+        date = date or today()
+        start = _as_datetime(date)
+        end = _as_datetime(date + timedelta(days=1))
+
+        qn = connection.ops.quote_name
+        links = Asset.sites.through
+        # Plain SQL so it runs as one INSERT ... SELECT
+        sql = ('INSERT INTO {table} (date, site_id, shapetag, username, '
+               'bytes, shapes, assets, ingests) '
+               'SELECT %s, l.{link_site}, s.shapetag, a.username, '
+               'COALESCE(SUM(s.size), 0), COUNT(s.id), COUNT(DISTINCT a.id), '
+               'COUNT(DISTINCT CASE WHEN a.created >= %s THEN a.id END) '
+               'FROM {shape} AS s '
+               'JOIN {asset} AS a ON a.id = s.asset_id '
+               'JOIN {links} AS l ON l.{link_asset} = a.id '
+               'WHERE l.{link_site} = %s AND a.created < %s '
+               'AND (a.deleted IS NULL OR a.deleted >= %s) '
+               'AND (s.deleted IS NULL OR s.deleted >= %s) '
+               'GROUP BY l.{link_site}, s.shapetag, a.username').format(
+            table=qn(cls._meta.db_table),
+            shape=qn(Shape._meta.db_table),
+            asset=qn(Asset._meta.db_table),
+            links=qn(links._meta.db_table),
+            link_asset=qn(links._meta.get_field('asset').column),
+            link_site=qn(links._meta.get_field('site').column))
+
+        with transaction.atomic():
+            cls.objects.filter(site=site, date=date).delete()
+            cursor = connection.cursor()
+            cursor.execute(sql, [date, start, site.pk, end, end, end])
+            return cursor.rowcount
+
+    @classmethod
+    def catch_up(cls, site):
+        """Snapshot ``site`` for today and each day since its last snapshot,
+        so its rows have no gaps when syncs are missed"""
+        last = cls.objects.filter(site=site).aggregate(
+            last=models.Max('date'))['last']
+        end = today()
+        date = end
+        if last is not None:
+            date = min(last + timedelta(days=1), end)
+        while date <= end:
+            cls.snapshot(site, date)
+            date += timedelta(days=1)
+
+    @classmethod
+    def series(cls, start=None, end=None, **filters):
+        """Totals for each day from ``start`` to ``end``, oldest first
+
+        Takes `DailyStorage` field lookups (e.g. ``site__domain``,
+        ``shapetag``) to total only some of the rows.
+
+        :returns:
+            A list of dicts of ``date``, ``bytes``, ``shapes``, ``assets`` and
+            ``ingests``
+        """
+        rows = cls.objects.filter(**filters)
+        if start:
+            rows = rows.filter(date__gte=start)
+        if end:
+            rows = rows.filter(date__lte=end)
+        # Annotations can't take the names of the fields they total
+        totals = rows.values('date').annotate(
+            **dict(('total_' + name, models.Sum(name))
+                   for name in cls.TOTALS)).order_by('date')
+        return [dict([('date', row['date'])] +
+                     [(name, row['total_' + name]) for name in cls.TOTALS])
+                for row in totals]
+
+
+class SiteSummary(models.Model):
+    """Totals of a site shown on the dashboard, as at its last completed sync
+
+    Counting them means joining every asset and shape of the site, so it's
+    done once per sync rather than on every page view. ``top_uploaders`` is a
+    list of ``[username, assets]``, most assets first.
+    """
+    site = models.OneToOneField('reporting.Site', primary_key=True,
+                                related_name='summary')
+    transcodes = models.IntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+    assets = models.IntegerField(default=0)
+    uploaders = models.IntegerField(default=0)
+    top_uploaders = jsonfield.JSONField(default=list, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    # Length of ``top_uploaders``
+    TOP_UPLOADERS = 20
+    # Fields counted by `site_totals`
+    TOTALS = ('assets', 'transcodes', 'size', 'uploaders')
+
+    class Meta:
+        verbose_name_plural = 'site summaries'
+
+    def __unicode__(self):
+        return unicode(self.site_id)
+
+    @classmethod
+    def refresh(cls, site):
+        """Recount the totals of ``site``"""
+        totals = site_totals(Site.objects.filter(pk=site.pk))
+        top_uploaders = Asset.objects.filter(sites=site) \
+                                     .values_list('username') \
+                                     .annotate(count=models.Count('id')) \
+                                     .order_by('-count', 'username')
+        summary = cls(site=site, top_uploaders=[
+            list(row) for row in top_uploaders[:cls.TOP_UPLOADERS]], **totals)
+        summary.save()
+        return summary
+
+    @classmethod
+    def for_sites(cls, sites):
+        """The summaries of ``sites``, counting those of sites which have none
+        yet (i.e. haven't completed a sync since summaries were added)"""
+        summaries = dict((summary.site_id, summary) for summary in
+                         cls.objects.filter(site__in=sites)
+                                    .select_related('site'))
+        for site in sites:
+            if site.pk not in summaries:
+                summaries[site.pk] = cls.refresh(site)
+        return summaries.values()
+
+    @property
+    def domain(self):
+        return self.site.domain
+
+
+class AllSitesSummary(models.Model):
+    """Totals over every site shown on the dashboard, as at the last
+    completed sync of any site
+
+    Assets can be linked to several sites and uploaders upload to several, so
+    these are counted over all the sites at once rather than summed from the
+    `SiteSummary` of each. There's only ever one row, see `current`.
+    """
+    transcodes = models.IntegerField(default=0)
+    size = models.BigIntegerField(default=0)
+    assets = models.IntegerField(default=0)
+    uploaders = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'all sites summary'
+
+    def __unicode__(self):
+        return u'All sites'
+
+    @classmethod
+    def refresh(cls):
+        """Recount the totals of every site"""
+        summary = cls(pk=1, **site_totals(Site.objects.all()))
+        summary.save()
+        return summary
+
+    @classmethod
+    def current(cls):
+        """The totals, counting them if they haven't been yet"""
+        try:
+            return cls.objects.get(pk=1)
+        except cls.DoesNotExist:
+            return cls.refresh()
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in SiteSummary.TOTALS)
+
+
+def site_totals(sites):
+    """The `SiteSummary.TOTALS` over ``sites``, each asset and uploader
+    counted once however many of the sites they're on"""
+    totals = sites.aggregate(
+        transcodes=models.Count('asset__shape'),
+        size=models.Sum('asset__shape__size'),
+        assets=models.Count('asset', distinct=True),
+        uploaders=models.Count('asset__username', distinct=True))
+    return dict((name, value or 0) for name, value in totals.items())
+
+
+def today():
+    """The current date where the site is"""
+    now = timezone.now()
+    if timezone.is_aware(now):
+        now = timezone.localtime(now)
+    return now.date()
+
+
+def _as_datetime(date):
+    """The start of ``date`` as a datetime comparable with stored ones"""
+    value = datetime.combine(date, datetime.min.time())
+    if settings.USE_TZ:
+        value = timezone.make_aware(value, timezone.get_current_timezone())
+    return value
+
+
 def get_asset(url):
     """Retrieve full information for specific asset"""
-    headers = {'content-type': 'application/json'}
-    headers.update(settings.BORK_AUTH)
-    response = GET(url, headers=headers)
-    json_response = load_json(response.content)
+    json_response = load_json(client.get_cached(url))
     return json_response
 
 
 def get_shapes_for_asset(asset_id):
     """Retrieve individual transcodes"""
-    headers = {'content-type': 'application/json'}
-    headers.update(settings.BORK_AUTH)
-    response = GET('{}item/{}/asset'.format(settings.BORK_URL, asset_id), headers=headers)
+    response = GET('{}item/{}/asset'.format(settings.BORK_URL, asset_id))
     json_response = load_json(response.content)
     return json_response.get('assets')
 
 
 def get_shape(url):
-    headers = {'content-type': 'application/json'}
-    headers.update(settings.BORK_AUTH)
-    response = GET('{}'.format(url), headers=headers)
-    json_response = load_json(response.content)
+    json_response = load_json(client.get_cached('{}'.format(url)))
     return json_response
 
 
 def perform_search(runas, filters = None):
     """Query Vidispine for assets"""
     log.debug('ZONZA API search request {0}'.format(filters))
-    headers = {'content-type': 'application/json'}
-    headers.update(settings.BORK_AUTH)
-    response = GET('{}item'.format(settings.BORK_URL), params=filters, headers=headers)
+    response = GET('{}item'.format(settings.BORK_URL), params=filters)
     json_response = load_json(response.content)
     return json_response
 
 
-def get_offsets(emitted, skip, precache):
-    """Compute vidispine search offsets from our iterator state"""
-    start_at = skip + emitted
-    asset = start_at % precache
-    page = start_at / precache + 1
-    return (asset, page)
+class PageSizer(object):
+    """Choose the size of each search page
+
+    With ``auto_tune`` the size doubles while pages come back quicker than
+    ``target`` seconds (fewer round trips) and halves when they are slower,
+    staying between ``per_page`` and ``max_per_page``. A size is only used at
+    offsets it divides, so every page lines up with the API's page numbers and
+    every offset stays a multiple of ``per_page``.
+    """
+
+    def __init__(self, per_page=None, auto_tune=False, target=None,
+                 max_per_page=None):
+        self.per_page = per_page or PER_PAGE
+        self.size = self.per_page
+        self.wanted = self.per_page
+        self.auto_tune = auto_tune
+        self.target = target or getattr(settings, 'SYNC_SEARCH_TARGET_TIME', 2.0)
+        self.max_per_page = max(max_per_page or getattr(
+            settings, 'SYNC_MAX_PER_PAGE', 1000), self.per_page)
+
+    def next_size(self, offset):
+        if self.wanted != self.size and offset % self.wanted == 0:
+            log.debug('Search page size now {0}'.format(self.wanted))
+            self.size = self.wanted
+        return self.size
+
+    def record(self, elapsed):
+        if not self.auto_tune:
+            return
+        if elapsed < self.target / 2 and self.size * 2 <= self.max_per_page:
+            self.wanted = self.size * 2
+        elif elapsed > self.target and self.size > self.per_page:
+            self.wanted = self.size / 2
+        else:
+            self.wanted = self.size
+
+
+def search_pages(zonza_site, offset=0, changed_since=None, sizer=None,
+                 metrics=None):
+    """Yield ``(result, start, end)`` for each page of search results
+
+    ``start`` and ``end`` are the offsets of the first result on the page and
+    of the first result on the next one. Searches are timed against
+    ``metrics``.
+    """
+    if metrics is not None:
+        metrics.bind()  # In whichever thread is doing the searching
+    sizer = sizer or PageSizer()
+    filters = {'zonza_site': zonza_site}
+    if changed_since:
+        # Overlap a little to allow for clock skew between us and the API
+        overlap = int(getattr(settings, 'SYNC_CHANGED_SINCE_OVERLAP', 300))
+        changed_since = changed_since - timedelta(seconds=overlap)
+        filter_name = getattr(settings, 'SYNC_CHANGED_SINCE_FILTER',
+                              'modified__gte')
+        filters[filter_name] = changed_since.isoformat()
 
+    while True:
+        size = sizer.next_size(offset)
+        filters[LIMIT_TOKEN] = size
+        filters[PAGE_TOKEN] = offset / size + 1
+        started = time.time()
+        with timer('search'):
+            result = perform_search(runas=None, filters=dict(filters))
+        sizer.record(time.time() - started)
 
-def asset_iterator(zonza_site, skip):
-    count = 0
-    consumed = 0
-    emitted = 0
-    existing = 0
-    msg = 'Synced {0}/{1} ({2} already existed)'
+        if not result.get('item'):
+            return
+        yield result, offset, offset + size
+        offset += size
+        if offset >= int(result.get('hits')):
+            return
+
+
+def prefetched(iterable, ahead):
+    """Iterate over ``iterable`` in a background thread
+
+    Up to ``ahead`` items are fetched in front of the consumer, so slow calls
+    made by ``iterable`` overlap with whatever the consumer does with each item.
+    Exceptions are re-raised in the consumer.
+    """
+    buffer = Queue.Queue(maxsize=ahead)
+    stop = threading.Event()
+
+    def put(entry):
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_END, None))
+        except Exception:
+            put((None, sys.exc_info()))
+        finally:
+            client.close()
+
+    thread = threading.Thread(target=produce, name='search-prefetch')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if error:
+                raise error[0], error[1], error[2]
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def asset_iterator(zonza_site, skip, changed_since=None, per_page=None,
+                   prefetch=None, auto_tune=False, metrics=None):
+    """Yield ``(asset, count, page)`` for each search result from ``skip`` on
+
+    ``count`` is the number of results expected and ``page`` the ``(start,
+    end)`` offsets of the search page the asset was on. Up to ``prefetch``
+    pages are searched for ahead of the consumer.
+    """
     skip = skip or 0
-    sync_message = lambda : msg.format(emitted, skip, count, existing)
-    per_page = PER_PAGE
-    assets_skipped = skip/per_page * per_page
-    filters = {
-        'zonza_site': zonza_site,
-        LIMIT_TOKEN: per_page,
-        PAGE_TOKEN: 1
-    }
+    sizer = PageSizer(per_page, auto_tune)
+    if prefetch is None:
+        prefetch = getattr(settings, 'SYNC_PREFETCH_PAGES', 2)
 
-    while True:
-        asset_offset, page = get_offsets(emitted, skip, per_page)
-        filters[PAGE_TOKEN] = page
-        try:
-            filters = filters
-            result = perform_search(runas=None, filters=filters)
-        except Exception as exc:
-            error = 'Error when searching for DamAsset: {0}'.format(exc)
-            raise
+    pages = search_pages(zonza_site, skip - skip % sizer.per_page,
+                         changed_since, sizer, metrics)
+    if prefetch:
+        pages = prefetched(pages, prefetch)
 
-        if not result.get('item'):
-            raise StopIteration
-        delay = int(getattr(settings, 'SYNC_CALL_DELAY', 0))
-        time.sleep(delay)
+    for result, start, end in pages:
         count = int(result.get('hits')) - skip
         for num, asset in enumerate(result.get('item')):
-            consumed += 1
-            if num >= asset_offset:
-                asset_id = asset['id']
-                vidi_ids = [{'id': asset_id}]
-                try:
-                    emitted += 1
-                    yield (asset, count)  # single-threaded
-                    #yield asset
-                except Exception as exc:
-                    error = 'Error when creating DamAsset: {0}'.format(exc)
-                    raise
-
-            hits = int(result.get('hits'))
-            if skip:
-                hits = hits - assets_skipped
-            if consumed >= hits:
-                raise StopIteration
+            if start + num >= skip:
+                yield (asset, count, (start, end))
@@ -1,95 +1,264 @@
-import csv
+import copy
+import tempfile
 from datetime import datetime, timedelta
-from tempfile import NamedTemporaryFile
 from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
+from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import ugettext_lazy as _
-from django.db.models import F, Max
-from django.contrib.sites.models import Site
+from django.db import connection
+from django.db.models import Avg, Count, F, Max, Min, Sum
 
-from reporting import models, utils
+from reporting import models, streaming, utils
 
 
 class CSVReport(object):
-    """An abstract csv serialisable report"""
+    """An abstract csv serialisable report
+
+    Reports computed entirely in SQL are streamed straight from ``COPY``.
+    Those with Python `formats` are read a batch at a time through a
+    server-side cursor and formatted a column at a time. Either way memory use
+    doesn't grow with the size of the report.
+
+    Reports over a long period are split into partitions of
+    ``REPORT_PARTITION_DAYS`` (and, with ``REPORT_PARTITION_BY_SITE``, by
+    site) generated concurrently by ``REPORT_WORKERS`` threads, each with its
+    own connection, then joined back together in order.
+    """
 
     columns = {}
-    extra_columns = {}
+    # SQL expressions which can be used in `columns`, by name
+    extra_select = OrderedDict()
+    # Python functions formatting the values of a column, by field
+    formats = {}
+    filename = 'report.csv'
 
     def __init__(self, start=None, end=None, site=None):
-        self.file = NamedTemporaryFile(delete=False)
-        self.writer = csv.writer(self.file, dialect=csv.excel)
+        # As asked for, before defaults are filled in
+        self.period = (start, end)
         if not end:
             end = datetime.now()
         if not start:
             start = end - timedelta(100)
         self.start = start
         self.end = end
-        self.site = site and Site.objects.get(name=site) or None
+        self.site = site and models.Site.objects.get(domain=site) or None
+        # Rows included, which is narrower than the period for a partition:
+        # (start, end, whether end is included)
+        self.window = (start, end, True)
+
+    def in_period(self, field):
+        """`filter` arguments limiting ``field`` to the report's rows"""
+        start, end, inclusive = self.window
+        return {field + '__gte': start,
+                field + ('__lte' if inclusive else '__lt'): end}
+
+    def headings(self):
+        return self.columns.keys()
+
+    def queryset(self):
+        raise NotImplementedError
 
-    def write_headings(self):
-        self.writer.writerow(self.columns.keys() + self.extra_columns.keys())
+    def extra_params(self):
+        """Parameters for the placeholders in `extra_select`, in order"""
+        return []
 
-    def serialise(self):
-        """Write report data to `self.file` before returning it
+    def sql(self):
+        """The whole report as a single query selecting `columns` in order
 
         :returns:
-            A temporary file handle containing CSV data
+            ``(sql, params)``
         """
-        raise NotImplementedError
+        queryset = self.queryset()
+        if self.extra_select:
+            queryset = queryset.extra(select=self.extra_select,
+                                      select_params=self.extra_params())
+        queryset = queryset.values_list(*self.columns.values())
+        sql, params = queryset.query.sql_with_params()
+
+        # Django selects extras first and aggregates last, whatever order
+        # they're asked for in, so name the columns by position and reorder
+        selected = (list(queryset.query.extra_select) +
+                    list(queryset.field_names) +
+                    list(queryset.query.aggregate_select))
+        aliases = ['c{0}'.format(index) for index in range(len(selected))]
+        wanted = [aliases[selected.index(field)]
+                  for field in self.columns.values()]
+        return ('SELECT {0} FROM ({1}) AS report ({2})'.format(
+            ', '.join(wanted), sql, ', '.join(aliases)), params)
+
+    def rows(self):
+        """Yield the headings followed by each formatted row"""
+        yield self.headings()
+        for row in self.body_rows():
+            yield row
+
+    def body_rows(self):
+        formats = [(index, self.formats[field]) for index, field
+                   in enumerate(self.columns.values()) if field in self.formats]
+        sql, params = self.sql()
+        for batch in streaming.server_side_batches(sql, params):
+            columns = [list(column) for column in zip(*batch)]
+            for index, format in formats:
+                columns[index] = map(format, columns[index])
+            for row in zip(*columns):
+                yield row
+
+    def write_body(self, file):
+        """Write the rows, without headings, as CSV to ``file``"""
+        if self.formats:
+            for chunk in streaming.csv_lines(self.body_rows()):
+                file.write(chunk)
+        else:
+            sql, params = self.sql()
+            streaming.copy_to(file, sql, params, header=False)
+
+    def partitions(self, days, by_site=False):
+        """Split the report into reports of ``days`` of rows each, in order
+
+        With ``by_site`` a report of every site is split by site too. Rows of
+        assets in several sites are already repeated per site when the report
+        has a site column, otherwise they'll be repeated in each site's
+        partition and assets without a site are left out.
+        """
+        windows = []
+        start = self.start
+        while True:
+            end = min(start + timedelta(days), self.end)
+            windows.append((start, end, end == self.end))
+            if end == self.end:
+                break
+            start = end
+        sites = [self.site]
+        if by_site and self.site is None:
+            sites = list(models.Site.objects.order_by('domain'))
+
+        for window in windows:
+            for site in sites:
+                partition = copy.copy(self)
+                partition.window = window
+                partition.site = site
+                yield partition
+
+    def chunks(self, progress=None):
+        """Yield the report as CSV, a chunk at a time
+
+        :param progress:
+            Optionally called with the number of partitions done so far and
+            the total, as the report is generated in partitions
+        """
+        workers = getattr(settings, 'REPORT_WORKERS', 1)
+        if workers > 1:
+            partitions = list(self.partitions(
+                getattr(settings, 'REPORT_PARTITION_DAYS', 92),
+                getattr(settings, 'REPORT_PARTITION_BY_SITE', False)))
+            if len(partitions) > 1:
+                return self.parallel_chunks(partitions, workers, progress)
+        if self.formats:
+            return streaming.csv_lines(self.rows())
+        sql, params = self.sql()
+        return streaming.copy_csv(sql, params, headings=self.headings())
+
+    def parallel_chunks(self, partitions, workers, progress=None):
+        """Yield the report as CSV, generating ``partitions`` concurrently
+
+        Each partition is written to its own temporary file, which is sent on
+        and removed once the partitions before it have been.
+        """
+        for chunk in streaming.csv_lines([self.headings()]):
+            yield chunk
+        pool = ThreadPool(min(workers, len(partitions)))
+        try:
+            for done, output in enumerate(pool.imap(write_partition,
+                                                    partitions), 1):
+                for chunk in streaming.file_chunks(output):
+                    yield chunk
+                if progress is not None:
+                    progress(done, len(partitions))
+        finally:
+            pool.terminate()
+
+    def cache_key(self):
+        """What the report's output depends on, besides its site
+
+        The data only changes when a sync completes, which drops the cached
+        reports of its site, so a report for the default period ending "now"
+        can be reused for the rest of the day.
+        """
+        start, end = self.period
+        return [self.__class__.__name__,
+                start and start.isoformat(),
+                end.isoformat() if end else datetime.now().date().isoformat()]
+
+    def cached_chunks(self, progress=None):
+        """`chunks`, from `models.report_cache` when the report was already
+        generated"""
+        site = self.site and self.site.domain
+        key = self.cache_key()
+        chunks = models.report_cache.get(site, key)
+        if chunks is None:
+            chunks = models.report_cache.store(site, key,
+                                               self.chunks(progress))
+        return chunks
+
+    def serialise(self, file, progress=None):
+        """Write the report as CSV to ``file``
+
+        :param progress:
+            As for `chunks`
+        :returns:
+            ``file``
+        """
+        for chunk in self.cached_chunks(progress):
+            file.write(chunk)
+        return file
+
+    def response(self):
+        """A streaming HTTP response downloading the report"""
+        return streaming.csv_response(self.cached_chunks(), self.filename)
 
 
 class UsageReport(CSVReport):
     """Report each shape for every item ingested in the period
 
     Also computes a usage metric for the time each shape has been on
-    the system (within the period)
+    the system (within the period). Everything is worked out in the query so
+    the report streams straight from ``COPY``.
     """
 
+    filename = 'usage-report.csv'
+
     columns = OrderedDict([
-        (_('Created'), 'item__created'),
-        (_('Item ID'), 'item__vs_id'),
+        (_('Created'), 'asset__created'),
+        (_('Item ID'), 'asset__vs_id'),
         (_('Shape ID'), 'vs_id'),
         (_('Shape Tag'), 'shapetag'),
-        (_('Shape Size'), 'size'),
+        (_('Shape Size'), 'size_display'),
         (_('Version'), 'version'),
-        (_('Filename'), 'item__filename'),
-        (_('Username'), 'item__username'),
-        (_('Sites'), 'item__sites__name'),
+        (_('Filename'), 'asset__filename'),
+        (_('Username'), 'asset__username'),
+        (_('Sites'), 'asset__sites__domain'),
         (_('Deleted On'), 'deleted'),
+        (_('Usage (GB days, to the nearest KB)'), 'usage'),
     ])
 
-    extra_columns = OrderedDict([
-        (_('Usage (GB days, to the nearest KB)'), utils.get_usage),
+    extra_select = OrderedDict([
+        ('size_display', utils.filesizeformat_sql('reporting_shape.size')),
+        ('usage', utils.usage_sql('reporting_shape.size',
+                                  'reporting_asset.created',
+                                  'reporting_shape.deleted')),
     ])
 
+    def extra_params(self):
+        return [self.end, self.start]
+
     def queryset(self):
-        shapes = models.Shape.objects.filter(item__created__range=(self.start, self.end))
+        shapes = models.Shape.objects.filter(**self.in_period('asset__created'))
         if self.site:
-            return shapes.filter(item__sites=self.site)
+            return shapes.filter(asset__sites=self.site)
         return shapes
 
-    def serialise(self):
-        self.write_headings()
-
-        for row in self.queryset().values(*self.columns.values()):
-            orig_row = row.copy()
-            row['size'] = utils.filesizeformat(row['size'])
-            new_row = [row[c] for c in self.columns.values()]
-
-            # Add extra computed columns
-            for key, func in self.extra_columns.items():
-                new_row.append(func(orig_row, self.start, self.end))
-
-            self.writer.writerow(new_row)
-
-        print self.file.name
-
-        self.file.flush()
-        self.file.close()
-        return self.file
-
 
 class IngestShapeReport(CSVReport):
     """Report all shapes ingested
@@ -97,77 +266,59 @@ class IngestShapeReport(CSVReport):
     NOTE: This will miss ingests that have no shapes
     """
 
+    filename = 'ingest-shape-report.csv'
+
     columns = OrderedDict([
-        (_('Ingested'), 'item__created'),
-        (_('User'), 'item__username'),
-        (_('Item ID'), 'item__vs_id'),
+        (_('Ingested'), 'asset__created'),
+        (_('User'), 'asset__username'),
+        (_('Item ID'), 'asset__vs_id'),
         (_('Shape ID'), 'vs_id'),
         (_('Version'), 'version'),
-        (_('Sites'), 'item__sites__name'),
-        (_('Filename'), 'item__filename'),
-        (_('Size'), 'item__size'),
+        (_('Sites'), 'asset__sites__domain'),
+        (_('Filename'), 'asset__filename'),
+        (_('Size'), 'size'),
     ])
 
     def queryset(self):
-        items = models.Shape.objects.filter(item__created__range=(self.start, self.end))
+        items = models.Shape.objects.filter(**self.in_period('asset__created'))
         if self.site:
-            return items.filter(item__sites=self.site)
+            return items.filter(asset__sites=self.site)
         return items
 
-    def serialise(self):
-        self.write_headings()
-
-        for row in self.queryset().values(*self.columns.values()):
-            new_row = [row[c] for c in self.columns.values()]
-
-            self.writer.writerow(new_row)
-
-        print self.file.name
-
-        self.file.flush()
-        self.file.close()
-        return self.file
-
 
 class IngestReport(CSVReport):
     """Report all items ingested, excluding versions
     """
 
+    filename = 'ingest-report.csv'
+
     columns = OrderedDict([
         (_('Ingested'), 'created'),
         (_('User'), 'username'),
         (_('Item ID'), 'vs_id'),
         (_('Versions'), 'versions'),
-        (_('Sites'), 'sites__name'),
+        (_('Sites'), 'sites__domain'),
         (_('Filename'), 'filename'),
         (_('Size'), 'size'),
     ])
 
+    formats = {'size': utils.filesizeformat}
+
     def queryset(self):
-        items = models.Asset.objects.filter(created__range=(self.start, self.end))
+        items = models.Asset.objects.filter(**self.in_period('created'))
         items = items.order_by('created')
-        items = items.annotate(versions=Max('shape__version'))
+        # Assets have no size of their own, the largest shape is the original
+        items = items.annotate(versions=Max('shape__version'),
+                               size=Max('shape__size'))
         if self.site:
             return items.filter(sites=self.site)
         return items
 
-    def serialise(self):
-        self.write_headings()
-
-        for row in self.queryset().values(*self.columns.values()):
-            row['size'] = utils.filesizeformat(row['size'])
-            new_row = [row[c] for c in self.columns.values()]
-            self.writer.writerow(new_row)
-
-        print self.file.name
-
-        self.file.flush()
-        self.file.close()
-        return self.file
-
 
 class DownloadReport(CSVReport):
 
+    filename = 'download-report.csv'
+
     columns = OrderedDict([
         (_('When'), 'when'),
         (_('User'), 'username'),
@@ -175,27 +326,175 @@ class DownloadReport(CSVReport):
         (_('Shape ID'), 'shape__vs_id'),
         (_('Shape Tag'), 'shape__shapetag'),
         (_('Version'), 'shape__version'),
-        (_('Sites'), 'item__sites__name'),
+        (_('Sites'), 'item__sites__domain'),
         (_('Size'), 'shape__size'),
         (_('Filename'), 'item__filename'),
     ])
 
+    formats = {'shape__size': utils.filesizeformat}
+
     def queryset(self):
-        downloads = models.Download.objects.filter(when__range=(self.start, self.end))
+        downloads = models.Download.objects.filter(**self.in_period('when'))
         if self.site:
             return downloads.filter(item__sites=self.site)
         return downloads
 
-    def serialise(self):
-        self.write_headings()
 
-        for row in self.queryset().values(*self.columns.values()):
-            row['shape__size'] = utils.filesizeformat(row['shape__size'])
-            new_row = [row[c] for c in self.columns.values()]
-            self.writer.writerow(new_row)
+def write_partition(report):
+    """Write ``report`` to a temporary file, in a `ThreadPool` worker
 
-        print self.file.name
+    :returns:
+        The file, rewound
+    """
+    output = tempfile.TemporaryFile()
+    try:
+        report.write_body(output)
+    except Exception:
+        output.close()
+        raise
+    finally:
+        # Each worker thread has its own connection
+        connection.close()
+    output.seek(0)
+    return output
+
+
+# Reports that can be downloaded, by the name used in their URL
+REPORTS = OrderedDict([
+    ('usage', UsageReport),
+    ('ingest', IngestReport),
+    ('ingest-shapes', IngestShapeReport),
+    ('downloads', DownloadReport),
+])
+
+
+# Aggregates available to `DefinedReport` columns
+AGGREGATES = {
+    'count': Count,
+    'count_distinct': lambda field: Count(field, distinct=True),
+    'sum': Sum,
+    'min': Min,
+    'max': Max,
+    'avg': Avg,
+}
+
+
+class DefinedReport(CSVReport):
+    """A report described by a definition rather than a class
+
+    Definitions are dicts, e.g. from the ``CUSTOM_REPORTS`` setting::
+
+        {
+            'model': 'asset',  # asset, shape or download
+            'columns': [
+                ['Item ID', 'vs_id'],  # Any field, as passed to values()
+                ['Category', 'raw_data:metadata.trials_category'],  # JSON path
+                ['Total Size', 'sum:shape__size'],  # Aggregate of a field
+            ],
+            'filters': {'deleted__isnull': True},  # Optional filter() kwargs
+        }
+
+    Aggregates (``count``, ``count_distinct``, ``sum``, ``min``, ``max`` and
+    ``avg``) are per row of the model. Rows are limited to those created in the
+    report's period and, given a site, to that site. The whole report compiles
+    to a single query streamed from ``COPY``.
+    """
+
+    # Name -> (model, date filtered on, site filtered on, payload model)
+    MODELS = {
+        'asset': (models.Asset, 'created', 'sites', models.AssetPayload),
+        'shape': (models.Shape, 'asset__created', 'asset__sites',
+                  models.ShapePayload),
+        'download': (models.Download, 'when', 'item__sites', None),
+    }
+
+    def __init__(self, definition, start=None, end=None, site=None,
+                 name='report'):
+        try:
+            self.model, self.date_field, self.site_field, self.payload_model = \
+                self.MODELS[definition.get('model')]
+        except KeyError:
+            raise ImproperlyConfigured('Reports can be of {0}'.format(
+                ', '.join(sorted(self.MODELS))))
+        self.definition = definition
+        self.filters = definition.get('filters') or {}
+        self.columns = OrderedDict()
+        self.extra_select = OrderedDict()
+        self.json_paths = []
+        self.aggregates = {}
+        for index, (heading, spec) in enumerate(definition.get('columns', [])):
+            if heading in self.columns:
+                raise ImproperlyConfigured(
+                    'Duplicate report column {0!r}'.format(heading))
+            self.columns[heading] = self.add_column(
+                'column_{0}'.format(index), spec)
+        if not self.columns:
+            raise ImproperlyConfigured('Reports need at least one column')
+
+        super(DefinedReport, self).__init__(start, end, site)
+        self.filename = '{0}.csv'.format(name)
+
+    def add_column(self, name, spec):
+        """Set up the column described by ``spec``
+
+        :returns:
+            What to select for it, as used in `columns`
+        """
+        kind, sep, value = spec.rpartition(':')
+        if not kind:
+            return value
+        if kind == 'raw_data':
+            if self.payload_model is None:
+                raise ImproperlyConfigured(
+                    '{0} has no raw_data'.format(self.model.__name__))
+            self.extra_select[name] = self.json_sql()
+            self.json_paths.append(value.split('.'))
+            return name
+        if kind in AGGREGATES:
+            self.aggregates[name] = AGGREGATES[kind](value)
+            return name
+        raise ImproperlyConfigured('Unknown report column {0!r}'.format(spec))
+
+    def json_sql(self):
+        """SQL selecting a path (the parameter) from the row's payload"""
+        qn = connection.ops.quote_name
+        payload = self.payload_model._meta
+        return ('(SELECT p.raw_data #>> %s FROM {payload} p '
+                'WHERE p.{owner} = {table}.{pk})').format(
+            payload=qn(payload.db_table),
+            owner=qn(payload.pk.column),
+            table=qn(self.model._meta.db_table),
+            pk=qn(self.model._meta.pk.column))
+
+    def extra_params(self):
+        return self.json_paths
+
+    def cache_key(self):
+        return super(DefinedReport, self).cache_key() + [self.definition]
+
+    def queryset(self):
+        items = self.model.objects.filter(**self.in_period(self.date_field))
+        if self.filters:
+            items = items.filter(**self.filters)
+        if self.site:
+            items = items.filter(**{self.site_field: self.site})
+        if self.aggregates:
+            items = items.annotate(**self.aggregates)
+        return items.order_by(self.date_field)
+
+
+def report_names():
+    """Names of the built in and configured reports"""
+    return list(REPORTS) + sorted(getattr(settings, 'CUSTOM_REPORTS', {}))
 
-        self.file.flush()
-        self.file.close()
-        return self.file
+
+def get_report(name, start=None, end=None, site=None):
+    """The built in report, or `CUSTOM_REPORTS` definition, called ``name``
+
+    :raises KeyError:
+        If there's no such report
+    """
+    if name in REPORTS:
+        return REPORTS[name](start, end, site)
+    definition = getattr(settings, 'CUSTOM_REPORTS', {})[name]
+    return DefinedReport(definition, start, end, site, name=name)
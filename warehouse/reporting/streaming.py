@@ -0,0 +1,208 @@
+"""Stream CSV exports to the client without holding them in memory
+
+Two sources are supported, both with constant memory use however big the
+export is:
+
+`copy_csv`
+    Postgres writes the CSV itself with ``COPY ... TO STDOUT``, for queries
+    needing no Python side formatting
+`server_side_batches` + `csv_lines`
+    Rows are read through a server-side cursor and formatted in Python
+"""
+import csv
+import sys
+import threading
+import uuid
+import Queue
+
+from django.db import connection, transaction
+from django.http import StreamingHttpResponse
+from django.utils.encoding import force_bytes
+from django.utils.functional import Promise
+
+
+# Bytes of CSV sent to the client at a time
+CHUNK_SIZE = 64 * 1024
+
+_DONE = object()
+
+
+class CopyCancelled(IOError):
+    pass
+
+
+class Echo(object):
+    """A file-like object handing back what's written, for `csv.writer`"""
+
+    def write(self, value):
+        return value
+
+
+class QueueWriter(object):
+    """File-like target for ``COPY`` handing chunks to the consuming thread
+
+    The queue is bounded so a slow client throttles the copy rather than its
+    output piling up in memory.
+    """
+
+    def __init__(self, chunks, cancelled, chunk_size=CHUNK_SIZE):
+        self.chunks = chunks
+        self.cancelled = cancelled
+        self.chunk_size = chunk_size
+        self.buffer = []
+        self.size = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.size += len(data)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.put(''.join(self.buffer))
+            self.buffer = []
+            self.size = 0
+
+    def put(self, item):
+        while True:
+            if self.cancelled.is_set():
+                raise CopyCancelled('Client went away')
+            try:
+                return self.chunks.put(item, timeout=0.5)
+            except Queue.Full:
+                continue
+
+
+def copy_to(file, sql, params=None, header=True):
+    """Write the CSV output of ``sql`` to ``file`` with ``COPY ... TO STDOUT``"""
+    cursor = connection.cursor()
+    query = 'COPY ({0}) TO STDOUT WITH CSV{1}'.format(
+        sql, ' HEADER' if header else '')
+    if params:
+        query = cursor.mogrify(query, params)
+    cursor.copy_expert(query, file)
+
+
+def copy_csv(sql, params=None, headings=None, buffer_chunks=16):
+    """Yield the CSV output of ``sql``, with a header, as Postgres produces it
+
+    The ``COPY`` runs in a thread with its own connection, so the rows are
+    sent to the client while the query is still running.
+
+    :param headings:
+        Column headings to use instead of the names of the selected columns
+    :param buffer_chunks:
+        Chunks to read ahead of the client at most
+    """
+    if headings is not None:
+        for chunk in csv_lines([headings]):
+            yield chunk
+
+    chunks = Queue.Queue(buffer_chunks)
+    cancelled = threading.Event()
+    errors = []
+
+    def run():
+        writer = QueueWriter(chunks, cancelled)
+        try:
+            copy_to(writer, sql, params, header=headings is None)
+            writer.flush()
+        except CopyCancelled:
+            pass
+        except Exception:
+            errors.append(sys.exc_info())
+        finally:
+            connection.close()
+            try:
+                writer.put(_DONE)
+            except CopyCancelled:
+                pass
+
+    thread = threading.Thread(target=run, name='copy-csv')
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                break
+            yield chunk
+    finally:
+        cancelled.set()
+    if errors:
+        exc_type, exc_value, exc_tb = errors[0]
+        raise exc_type, exc_value, exc_tb
+
+
+def server_side_batches(sql, params=None, batch_size=2000):
+    """Yield the rows of ``sql`` in lists of up to ``batch_size``
+
+    They come from a named cursor, so only one batch is held in memory at a
+    time.
+    """
+    # Named cursors only live as long as their transaction
+    with transaction.atomic():
+        connection.ensure_connection()
+        cursor = connection.connection.cursor(
+            name='stream_{0}'.format(uuid.uuid4().hex))
+        cursor.itersize = batch_size
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+        cursor.close()
+
+
+def server_side_rows(sql, params=None, batch_size=2000):
+    """Yield the rows of ``sql`` without loading them all at once"""
+    for rows in server_side_batches(sql, params, batch_size):
+        for row in rows:
+            yield row
+
+
+def file_chunks(file, chunk_size=CHUNK_SIZE):
+    """Yield the contents of ``file``, closing it once they've all been read"""
+    with file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def _encode(value):
+    if isinstance(value, (unicode, Promise)):
+        return force_bytes(value)
+    return value
+
+
+def csv_lines(rows, chunk_size=CHUNK_SIZE):
+    """Encode ``rows`` as CSV, yielding around ``chunk_size`` bytes at a time
+
+    Lines end in ``\n`` like those of ``COPY``, so headings written here and
+    rows from `copy_csv` make consistent files.
+    """
+    writer = csv.writer(Echo(), dialect=csv.excel, lineterminator='\n')
+    buffer = []
+    size = 0
+    for row in rows:
+        line = writer.writerow([_encode(value) for value in row])
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def csv_response(chunks, filename):
+    """A `StreamingHttpResponse` downloading ``chunks`` as ``filename``"""
+    response = StreamingHttpResponse(chunks, content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename={0}'.format(
+        filename)
+    return response
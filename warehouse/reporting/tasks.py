@@ -1,43 +1,115 @@
+"""Work run in the background, as `Job`s picked up by ``run_jobs`` workers
+
+Handlers take the `Job` and return the path of the file they produced, if
+any. Queue work with e.g. ``Job.enqueue('report', report='usage')``.
+"""
+import errno
 import logging
+import os
+import tempfile
+import threading
+import traceback
+from datetime import timedelta
 
-#from celery.task import PeriodicTask
-#from celery.schedules import crontab
-#from celery.registry import tasks
+from dateutil import parser
 
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
 from django.utils import timezone
 
-from reporting.models import Asset
+from reporting import reports
+from reporting.models import Job
 
 log = logging.getLogger(__name__)
 
-PERCENTILES = 100
+OUTPUT_DIR = getattr(settings, 'JOB_OUTPUT_DIR', os.path.join(
+    tempfile.gettempdir(), 'warehouse-jobs'))
+# Seconds between heartbeats of a running job
+HEARTBEAT = 30
+
+
+def run_report(job):
+    """Generate ``params['report']`` to a file
+
+    Takes optional ``start`` and ``end`` (ISO dates) and ``site`` params.
+    """
+    params = job.params
+    start, end = [parser.parse(params[name]) if params.get(name) else None
+                  for name in ('start', 'end')]
+    report = reports.get_report(params['report'], start, end,
+                                params.get('site'))
+
+    try:
+        os.makedirs(OUTPUT_DIR)
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    path = os.path.join(OUTPUT_DIR, '{0}-{1}'.format(job.pk, report.filename))
+    try:
+        with open(path, 'wb') as output:
+            report.serialise(output, progress=job.set_progress)
+    except Exception:
+        remove(path)
+        raise
+    return path
+
+
+def run_sync(job):
+    """Run ``sync_report_data`` with ``params`` as its options"""
+    call_command('sync_report_data', **job.params)
+    return ''
+
 
+# Job kind -> handler
+TASKS = {
+    'report': run_report,
+    'sync': run_sync,
+}
 
-#class SyncReportDataTask(PeriodicTask):
-    #"""Called asynchronously by CeleryBeat Scheduler"""
 
-    #name = "reporting.tasks.SyncReportDataTask"
-    #routing_key = "celery"
-    #run_every = crontab(hour="4")
+def run(job):
+    """Run ``job``, recording how it went on it"""
+    log.info('Running {0}'.format(job))
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=beat, args=(job, stop),
+                                 name='job-{0}-heartbeat'.format(job.pk))
+    heartbeat.daemon = True
+    heartbeat.start()
+    try:
+        result = TASKS[job.kind](job)
+    except Exception:
+        log.exception('{0} failed'.format(job))
+        job.fail(traceback.format_exc())
+    else:
+        job.finish(result)
+        log.info('Finished {0}'.format(job))
+    finally:
+        stop.set()
+        heartbeat.join()
 
-    #def run(self, hours=24, **kwargs):
 
-        #log.debug('SyncReportDataTask: Started at {0}'.format(
-                #timezone.now().isoformat()))
+def beat(job, stop):
+    """Keep the job's heartbeat up to date until ``stop`` is set"""
+    try:
+        while not stop.wait(HEARTBEAT):
+            job.beat()
+    finally:
+        connection.close()
 
-        #objects = Asset.vidispine_objects.all()
-        #count = objects.count()
-        #done = 0
 
-        #for item in objects:
-            #done += 1
-            #self.update_progress(done, count)
+def remove_old_results(days):
+    """Delete the files of jobs which finished more than ``days`` ago"""
+    finished = timezone.now() - timedelta(days)
+    old = Job.objects.filter(finished__lt=finished).exclude(result='')
+    for job in old:
+        remove(job.result)
+    old.update(result='')
 
-    #def update_progress(self, done, count):
-        #percentiles = [int(count * percentile / PERCENTILES)
-                       #for percentile in range(0, PERCENTILES + 1)]
-        #if done in percentiles:
-            #log.debug('SyncReportDataTask: {0}% ({1}/{2})'.format(
-                    #int(PERCENTILES * done / count), done, count))
 
-#tasks.register(SyncReportDataTask)
+def remove(path):
+    try:
+        os.remove(path)
+    except OSError as exc:
+        if exc.errno != errno.ENOENT:
+            raise
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+from django.test import TestCase
+from django.utils.timezone import utc
+
+from reporting import bulk
+from reporting.models import Asset, Site, SyncRun
+
+
+class UpsertChangedTests(TestCase):
+    """Rows are only rewritten when their ``content_hash`` changes"""
+
+    def setUp(self):
+        site = Site.objects.create(domain='trials.zonza.tv')
+        self.first, self.second = [
+            SyncRun.objects.create(sync_uuid=sync_uuid, site=site)
+            for sync_uuid in ('first', 'second')]
+        self.pks = self.sync(self.first, 'a', 'one.mov', {'version': 1})
+
+    def sync(self, sync_run, content_hash, filename, payload):
+        now = datetime.now(utc)
+        row = {
+            'vs_id': 'VX-1',
+            'content_hash': content_hash,
+            'filename': filename,
+            'username': 'bob',
+            'created': datetime(2015, 1, 1, tzinfo=utc),
+            'deleted': None,
+            'last_sync_id': sync_run.pk,
+            'last_synced': now,
+        }
+        touch = {'last_sync': sync_run, 'last_synced': now, 'deleted': None}
+        return bulk.upsert_changed(Asset, [row], touch,
+                                   payloads={'VX-1': payload})
+
+    def test_unchanged_hash_only_touches(self):
+        pks = self.sync(self.second, 'a', 'two.mov', {'version': 2})
+        self.assertEqual(pks, self.pks)
+        asset = Asset.objects.get(pk=pks['VX-1'])
+        self.assertEqual(asset.last_sync, self.second)
+        self.assertEqual(asset.filename, 'one.mov')
+        self.assertEqual(asset.raw_data, {'version': 1})
+
+    def test_changed_hash_rewrites(self):
+        pks = self.sync(self.second, 'b', 'two.mov', {'version': 2})
+        self.assertEqual(pks, self.pks)
+        asset = Asset.objects.get(pk=pks['VX-1'])
+        self.assertEqual(asset.last_sync, self.second)
+        self.assertEqual(asset.filename, 'two.mov')
+        self.assertEqual(asset.content_hash, 'b')
+        self.assertEqual(asset.raw_data, {'version': 2})
@@ -0,0 +1,54 @@
+import json
+
+from django.test import SimpleTestCase
+
+from reporting.models import Asset
+
+
+class JSONBLookupTests(SimpleTestCase):
+    """The SQL `JSONBField` lookups compile to, without running it"""
+
+    column = '"reporting_assetpayload"."raw_data"'
+
+    def compile(self, **filters):
+        query = Asset.objects.filter(**filters).query
+        sql, params = query.get_compiler('default').as_sql()
+        return sql, list(params)
+
+    def test_nested_key(self):
+        # Matches the expression index on the payload table
+        sql, params = self.compile(
+            payload__raw_data__metadata__zonza_site='trials.zonza.tv')
+        self.assertIn('(({0} -> %s) ->> %s) = %s'.format(self.column), sql)
+        self.assertEqual(params[-3:],
+                         ['metadata', 'zonza_site', 'trials.zonza.tv'])
+
+    def test_single_key(self):
+        sql, params = self.compile(payload__raw_data__metadata='x')
+        self.assertIn('({0} ->> %s) = %s'.format(self.column), sql)
+        self.assertEqual(params[-2:], ['metadata', 'x'])
+
+    def test_nested_key_lookup(self):
+        sql, params = self.compile(
+            payload__raw_data__metadata__zonza_site__isnull=True)
+        self.assertIn('(({0} -> %s) ->> %s) IS NULL'.format(self.column), sql)
+        self.assertEqual(params[-2:], ['metadata', 'zonza_site'])
+
+    def test_contains(self):
+        value = {'metadata': {'user': 'bob'}}
+        sql, params = self.compile(payload__raw_data__contains=value)
+        self.assertIn('{0} @> %s::jsonb'.format(self.column), sql)
+        self.assertEqual(json.loads(params[-1]), value)
+
+    def test_key_contains(self):
+        # The key stays jsonb for the jsonb lookups
+        sql, params = self.compile(
+            payload__raw_data__metadata__contains={'user': 'bob'})
+        self.assertIn('({0} -> %s) @> %s::jsonb'.format(self.column), sql)
+        self.assertEqual(params[-2], 'metadata')
+        self.assertEqual(json.loads(params[-1]), {'user': 'bob'})
+
+    def test_has_key(self):
+        sql, params = self.compile(payload__raw_data__has_key='metadata')
+        self.assertIn('{0} ? %s'.format(self.column), sql)
+        self.assertEqual(params[-1], 'metadata')
@@ -0,0 +1,51 @@
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.utils.timezone import utc
+
+from reporting import utils
+
+
+def _datetime(*args):
+    return datetime(*args, tzinfo=utc)
+
+
+class UsageSQLTests(TestCase):
+    """`usage_sql` agrees with `get_usage` on the edges of the period"""
+
+    start = _datetime(2015, 1, 1)
+    end = _datetime(2015, 2, 1)
+    size = 3 * 1024 ** 3
+
+    def usage(self, created, deleted):
+        sql = ('SELECT {0} FROM (VALUES (%s::bigint, %s::timestamptz, '
+               '%s::timestamptz)) AS s (size, created, deleted)').format(
+            utils.usage_sql('s.size', 's.created', 's.deleted'))
+        cursor = connection.cursor()
+        cursor.execute(sql, [self.end, self.start, self.size, created,
+                             deleted])
+        return cursor.fetchone()[0]
+
+    def assertUsage(self, created, deleted, days):
+        expected = utils.get_usage({'asset__created': created,
+                                    'deleted': deleted,
+                                    'size': self.size}, self.start, self.end)
+        self.assertEqual(Decimal(expected), Decimal(3 * days))
+        self.assertEqual(self.usage(created, deleted), Decimal(expected))
+
+    def test_not_deleted(self):
+        self.assertUsage(_datetime(2014, 6, 1), None, 31)
+
+    def test_created_within(self):
+        self.assertUsage(_datetime(2015, 1, 11, 12), None, 20)
+
+    def test_deleted_within(self):
+        self.assertUsage(_datetime(2014, 6, 1), _datetime(2015, 1, 6), 5)
+
+    def test_deleted_before_start(self):
+        self.assertUsage(_datetime(2014, 6, 1), _datetime(2014, 12, 1), 0)
+
+    def test_created_after_end(self):
+        self.assertUsage(_datetime(2015, 3, 1), None, 0)
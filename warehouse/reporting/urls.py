@@ -1,7 +1,7 @@
 from django.conf.urls import patterns, include, url
 from django.contrib import admin
 
-from reporting import views
+from reporting import api, views
 
 
 admin.autodiscover()
@@ -9,5 +9,19 @@ admin.autodiscover()
 urlpatterns = patterns('',
     url(r'^$', views.dashboard, name='dashboard'),
     url(r'^download/$', views.download_csv, name='download_csv'),
+    url(r'^reports/(?P<name>[\w-]+)\.csv$', views.download_report,
+        name='download_report'),
+    url(r'^reports/(?P<name>[\w-]+)/jobs/$', views.queue_report,
+        name='queue_report'),
+    url(r'^sync/$', views.queue_sync, name='queue_sync'),
+    url(r'^jobs/(?P<job_id>\d+)/$', views.job, name='job'),
+    url(r'^jobs/(?P<job_id>\d+)/download/$', views.job_download,
+        name='job_download'),
     url(r'^domain/(?P<domain>.+)/', views.domain, name='domain'),
+    url(r'^api/sites/$', api.sites, name='api_sites'),
+    url(r'^api/assets/$', api.assets, name='api_assets'),
+    url(r'^api/shapes/$', api.shapes, name='api_shapes'),
+    url(r'^api/downloads/$', api.downloads, name='api_downloads'),
+    url(r'^api/storage/$', api.storage, name='api_storage'),
+    url(r'^api/totals/$', api.totals, name='api_totals'),
 )
@@ -1,4 +1,8 @@
+from django.core.exceptions import ImproperlyConfigured
+
+
 def filesizeformat(num):
+    num = num or 0
     for size in ['bytes', 'KB', 'MB', 'GB']:
         if num < 1024.0:
             return "%3.2f%s" % (num, size)
@@ -19,12 +23,38 @@ def get_days_elapsed(created, deleted, start, end):
     if created > start:
         actual_start = created
     if deleted and deleted < end:
-        actual_end = end
-    return (actual_end - actual_start).days
+        actual_end = deleted
+    # Nothing is used by shapes deleted before the period or created after it
+    return max((actual_end - actual_start).days, 0)
 
 
 def get_usage(shape_row, start, end):
-    days = get_days_elapsed(shape_row['item__created'],
+    days = get_days_elapsed(shape_row['asset__created'],
                             shape_row['deleted'],
                             start, end)
     return bytes_to_gb(shape_row['size'] * days)
+
+
+# SQL equivalents of the above, for reports computed entirely in the database
+
+def filesizeformat_sql(column):
+    """SQL formatting ``column`` (a size in bytes) like `filesizeformat`"""
+    cases = ["WHEN {0} < {1} THEN round({0} / {2}.0, 2) || '{3}'".format(
+                 column, 1024 ** (power + 1), 1024 ** power, unit)
+             for power, unit in enumerate(['bytes', 'KB', 'MB', 'GB'])]
+    return 'CASE {0} ELSE round({1} / {2}.0, 2) || \'TB\' END'.format(
+        ' '.join(cases), column, 1024 ** 4)
+
+
+def usage_sql(size, created, deleted):
+    """SQL computing `get_usage` from the ``size``, ``created`` and
+    ``deleted`` columns
+
+    Takes the end and the start of the period as parameters, in that order.
+    """
+    # LEAST ignores NULLs, so shapes which aren't deleted count to the end
+    days = ('GREATEST(floor(extract(epoch FROM LEAST(%s, {deleted}) - '
+            'GREATEST(%s, {created})) / 86400), 0)').format(
+        created=created, deleted=deleted)
+    return 'round({size}::numeric * {days} / {gb}, 6)'.format(
+        size=size, days=days, gb=1024 ** 3)
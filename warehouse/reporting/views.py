@@ -1,39 +1,73 @@
-from cStringIO import StringIO
 import json
+import os
+from datetime import timedelta
+from urllib import urlencode
 
-from django.http import HttpResponse
+from dateutil import parser
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.views.decorators.http import require_POST
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.shortcuts import render, redirect
+from django.shortcuts import get_object_or_404, render, redirect
 from django.template.context import RequestContext
-from django.db import connection
-from django.db.models import Count, Sum, Max, F
+from django.db.models import Max, F
 from django.contrib import admin
 from django.core.urlresolvers import reverse
 
-from reporting.models import Asset, SyncRun, Site
+from reporting import reports, streaming
+from reporting.models import (AllSitesSummary, Asset, DailyStorage, Job,
+                              SiteSummary, SyncRun, Site, report_cache, today)
+
+
+# Days shown on the charts over time
+CHART_DAYS = getattr(settings, 'CHART_DAYS', 90)
+
+
+def top_uploaders_of(summaries, count):
+    """The ``count`` uploaders with the most assets on any of the sites
+
+    Each summary keeps its site's top uploaders, so these are exact for up to
+    `SiteSummary.TOP_UPLOADERS`.
+    """
+    uploaders = [{'domain': summary.domain, 'username': username,
+                  'count': assets}
+                 for summary in summaries
+                 for username, assets in summary.top_uploaders]
+    uploaders.sort(key=lambda uploader: uploader['count'], reverse=True)
+    return uploaders[:count]
+
+
+def chart_data(series, total):
+    """``[[date, value], ...]`` of the ``total`` in a `DailyStorage.series`,
+    as JSON for the charts"""
+    return json.dumps([[row['date'].isoformat(), row[total] or 0]
+                       for row in series])
 
 
 def domain(request, domain):
-    sync_runs = SyncRun.objects.filter(site__domain__contains=domain).order_by('-start_time')
+    site = get_object_or_404(Site, domain=domain)
+    sync_runs = SyncRun.objects.filter(site=site).order_by('-start_time')
     try:
         last_sync = sync_runs.filter(completed=True)[0]
     except IndexError:
         last_sync = None
 
-    all_sites = Site.objects.filter(domain=domain)
-    size_by_site = all_sites.values('domain') \
-            .annotate(
-                transcodes=Count('asset__shape'),
-                size=Sum('asset__shape__size'),
-                count=Count('asset', distinct=True),
-                uploaders=Count('asset__username', distinct=True)) \
-            .order_by('-size')
-    top_uploaders = all_sites.values('domain', 'asset__username') \
-            .annotate(count=Count('asset')).order_by('-count')[:20]
+    # Counted at the end of each sync, see `SiteSummary`
+    size_by_site = SiteSummary.for_sites([site])
+    top_uploaders = top_uploaders_of(size_by_site, 20)
+
+    # From the rollup rather than every shape of the site
+    storage = DailyStorage.series(today() - timedelta(days=CHART_DAYS),
+                                  site__domain=domain)
+    ingests = DailyStorage.series(today() - timedelta(days=CHART_DAYS),
+                                  site__domain=domain, shapetag='original')
 
     params = {
         'domain': domain,
+        'storage_over_time': chart_data(storage, 'bytes'),
+        'ingests_over_time': chart_data(ingests, 'ingests'),
         'site_header': admin.site.site_header + " for " + domain,
         'last_sync': last_sync,
         'last_syncs': sync_runs[:5],
@@ -46,25 +80,120 @@ def domain(request, domain):
                   context_instance=RequestContext(request))
 
 
-def download_csv(domain):
-    csv_file = StringIO()
+def download_csv(request):
+    # Postgres generates CSV for us, we stream it directly to the user.
+    # Filtering on the site uses the index on the metadata key
+    where, params = '', []
+    if request.GET.get('site'):
+        where = "WHERE p.raw_data -> 'metadata' ->> 'zonza_site' = %s"
+        params = [request.GET['site']]
+    raw_sql = """SELECT
+        p.asset_id as id,
+        p.raw_data -> 'metadata' ->> 'zonza_site' as "Sites",
+        p.raw_data -> 'metadata' ->> 'trials_category' as "Category"
+    FROM reporting_assetpayload p
+    {0}""".format(where)
+
+    site = request.GET.get('site')
+    chunks = report_cache.get(site, ['download_csv'])
+    if chunks is None:
+        chunks = report_cache.store(site, ['download_csv'],
+                                    streaming.copy_csv(raw_sql, params))
+    return streaming.csv_response(chunks, 'zonza-asset-report.csv')
+
+
+def download_report(request, name):
+    """Stream a built in or configured report (see `reports.get_report`)
+
+    Takes optional ``start`` and ``end`` dates and a ``site`` domain
+    """
+    try:
+        start, end = [parser.parse(request.GET[param])
+                      if request.GET.get(param) else None
+                      for param in ('start', 'end')]
+    except ValueError:
+        return HttpResponseBadRequest('Dates must be in the form YYYY-MM-DD')
+    try:
+        report = reports.get_report(name, start, end, request.GET.get('site'))
+    except KeyError:
+        raise Http404('No such report')
+    except Site.DoesNotExist:
+        raise Http404('No such site')
+    return report.response()
+
+
+@staff_member_required
+@require_POST
+def queue_report(request, name):
+    """Generate a report in the background, see `job`
+
+    Takes the same ``start``, ``end`` and ``site`` as `download_report`
+    """
+    if name not in reports.report_names():
+        raise Http404('No such report')
+    params = {'report': name}
+    try:
+        for param in ('start', 'end'):
+            if request.POST.get(param):
+                params[param] = parser.parse(request.POST[param]).isoformat()
+    except ValueError:
+        return HttpResponseBadRequest('Dates must be in the form YYYY-MM-DD')
+    if request.POST.get('site'):
+        params['site'] = get_object_or_404(Site,
+                                           domain=request.POST['site']).domain
+    job = Job.enqueue('report', **params)
+    return redirect('job', job.pk)
+
+
+@staff_member_required
+@require_POST
+def queue_sync(request):
+    """Sync a site (``site``), or every site, in the background"""
+    if request.POST.get('site'):
+        params = {'zonza_site': get_object_or_404(
+            Site, domain=request.POST['site']).domain}
+    else:
+        params = {'all_sites': True}
+    job = Job.enqueue('sync', **params)
+    return redirect('job', job.pk)
+
+
+def job(request, job_id):
+    """Status and progress of a background job, as JSON with ?format=json"""
+    job = get_object_or_404(Job, pk=job_id)
+    download = None
+    if job.status == Job.DONE and job.result:
+        download = reverse('job_download', args=(job.pk,))
+
+    if request.GET.get('format') == 'json' or request.is_ajax():
+        return HttpResponse(json.dumps({
+            'id': job.pk,
+            'kind': job.kind,
+            'status': job.status,
+            'progress': job.progress,
+            'message': job.message,
+            'download': download,
+        }), content_type='application/json')
 
-    # Postgres generates CSV for us, we just serve it directly to the user
-    raw_sql = """COPY
-    (SELECT
-        id,
-        raw_data::json->'metadata'->>'zonza_site' as "Sites",
-        raw_data::json->'metadata'->>'trials_category' as "Category"
-    FROM reporting_asset)
-    TO STDOUT CSV HEADER;"""
-    cursor = connection.cursor()
-    cursor.copy_expert(raw_sql, csv_file)
+    params = {
+        'site_header': admin.site.site_header,
+        'job': job,
+        'download': download,
+    }
+    return render(request, 'reporting/job.html', params,
+                  context_instance=RequestContext(request))
 
-    filename = 'zonza-asset-report.csv'
-    response = HttpResponse(csv_file.getvalue(), content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename={}'.format(filename)
 
-    return response
+@staff_member_required
+def job_download(request, job_id):
+    """Stream the file a finished job produced"""
+    job = get_object_or_404(Job, pk=job_id, status=Job.DONE)
+    try:
+        output = open(job.result, 'rb')
+    except IOError:
+        raise Http404('The result of this job is no longer available')
+    filename = os.path.basename(job.result).split('-', 1)[-1]
+    return streaming.csv_response(streaming.file_chunks(output), filename)
 
 
 #@staff_member_required
@@ -76,43 +205,33 @@ def dashboard(request):
     except IndexError:
         last_sync = None
 
-    all_sites = Site.objects.all()
-    #num_assets_by_site = all_sites.values('domain') \
-            #.annotate(count=Count('asset')).order_by('-count')
-    #num_uploaders_by_site = all_sites.values('domain') \
-            #.annotate(uploaders=Count('asset__username', distinct=True))
+    summaries = SiteSummary.for_sites(Site.objects.all())
     # TODO: add days since last since per site
-    size_by_site = all_sites.values('domain') \
-            .annotate(
-                transcodes=Count('asset__shape'),
-                size=Sum('asset__shape__size'),
-                count=Count('asset', distinct=True),
-                uploaders=Count('asset__username', distinct=True)) \
-            .order_by('-count')[:10]
-    sizes = all_sites.aggregate(
-                count=Count('asset', distinct=True),
-                transcodes=Count('asset__shape'),
-                size=Sum('asset__shape__size'),
-                uploaders=Count('asset__username', distinct=True))
-    top_uploaders = all_sites.values('domain', 'asset__username') \
-            .annotate(count=Count('asset')).order_by('-count')[:10]
-    x = [x for x in all_sites.values('domain')
-            .annotate(size=Count('asset', distinct=True))
-            .annotate(total=Sum('asset__shape__size'))
-            .order_by('-size')  # TODO: Figure out why sorting by total is buggy
-            .values_list('domain', 'size')]
-    graph_assets_data = x[:5]
-    graph_assets_data = [[x,y,reverse('reporting.views.domain', args=(x,))]
-                         for x, y in graph_assets_data]
-    # [["teamhills.zonza.tv", null], ["deluxe.zonza.tv", null], ["trials.zonza.tv", 243497942962], ["grey.zonza.tv", 135888998176], ["230pas.zonza.tv", 48393166596], ["zonzacompany.zonza.tv", 5456789214], ["trg-deluxe.zonza.tv", 2953964488], ["gmi-deluxe.zonza.tv", 2182796439]]'
+    size_by_site = sorted(summaries, key=lambda summary: summary.assets,
+                          reverse=True)
+    sizes = AllSitesSummary.current().as_dict()
+    top_uploaders = top_uploaders_of(summaries, 10)
+    graph_assets_data = [[summary.domain, summary.assets,
+                          reverse('reporting.views.domain',
+                                  args=(summary.domain,))]
+                         for summary in size_by_site[:5]]
+
+    # Loaded from the API by the page. Up to yesterday, as sites which
+    # haven't synced yet today have no rows for it
+    storage_url = '{0}?{1}'.format(reverse('api_storage'), urlencode({
+        'start': (today() - timedelta(days=CHART_DAYS)).isoformat(),
+        'end': (today() - timedelta(days=1)).isoformat(),
+        'fields': 'date,bytes',
+    }))
 
     params = {
         'site_header': admin.site.site_header,
+        'storage_url': storage_url,
         'last_sync': last_sync,
         'last_syncs': sync_runs[:5],
         'sizes': sizes,
         'sizes_json': json.dumps(sizes),
-        'size_by_site': size_by_site,
+        'size_by_site': size_by_site[:10],
         'top_uploaders': top_uploaders,
         'graph_assets_data': json.dumps(graph_assets_data)
     }
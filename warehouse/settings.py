@@ -126,6 +126,71 @@ BORK_AUTH = {
     'Bork-Token': os.environ.get('APPSETTING_BORK_TOKEN'),
     'Bork-Username': os.environ.get('APPSETTING_BORK_USERNAME'),
 }
+BORK_POOL_SIZE = 10
+BORK_TIMEOUT = (5, 60)  # (connect, read) seconds
+BORK_MAX_RETRIES = 3
+BORK_RETRY_BACKOFF = (1, 10)  # (multiplier, max) seconds
+BORK_RATE_LIMIT = None  # requests/sec, None for unlimited
+BORK_CONCURRENCY = (1, 20)  # (min, max) calls in flight
+BORK_LATENCY_TARGET = 2.0  # seconds
+BORK_CACHE_DIR = os.path.join(PROJECT_ROOT, '..', 'cache', 'bork')
+BORK_CACHE_MAX_SIZE = 1024 ** 3  # bytes
+
+# Search filter and clock skew allowance (seconds) for incremental syncs
+SYNC_CHANGED_SINCE_FILTER = 'modified__gte'
+SYNC_CHANGED_SINCE_OVERLAP = 300
+
+# Search paging: results per page, pages fetched ahead of the workers and, with
+# --auto-page-size, the largest page and the search time to aim for (seconds)
+SYNC_PER_PAGE = 100
+SYNC_PREFETCH_PAGES = 2
+SYNC_MAX_PER_PAGE = 1000
+SYNC_SEARCH_TARGET_TIME = 2.0
+
+# Where generated reports are kept until a sync changes their data, None to
+# disable, and how much space they can take (bytes)
+REPORT_CACHE_DIR = os.path.join(PROJECT_ROOT, '..', 'cache', 'reports')
+REPORT_CACHE_MAX_SIZE = 5 * 1024 ** 3
+
+# Reports over more than REPORT_PARTITION_DAYS are generated in partitions of
+# that many days (and by site, with REPORT_PARTITION_BY_SITE), REPORT_WORKERS
+# at a time. 1 worker generates every report in one go
+REPORT_WORKERS = 4
+REPORT_PARTITION_DAYS = 92
+REPORT_PARTITION_BY_SITE = False
+
+# Background jobs (see the run_jobs command): where their files go, for how
+# long (days), how often idle workers look for jobs and after how long without
+# a heartbeat (seconds) a running job is assumed lost
+JOB_OUTPUT_DIR = os.path.join(PROJECT_ROOT, '..', 'cache', 'jobs')
+JOB_KEEP_RESULTS_DAYS = 7
+JOB_POLL_INTERVAL = 5
+JOB_STALE_AFTER = 300
+
+# Days shown on the dashboard charts over time (from the DailyStorage rollup)
+CHART_DAYS = 90
+
+# JSON API (/api/): rows per page by default and at most, and seconds clients
+# and proxies may reuse a response before revalidating it
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+API_MAX_AGE = 60
+
+# Reports configured without code, downloaded from /reports/<name>.csv. See
+# reporting.reports.DefinedReport for the format
+CUSTOM_REPORTS = {
+    'asset-categories': {
+        'model': 'asset',
+        'columns': [
+            ['Item ID', 'vs_id'],
+            ['User', 'username'],
+            ['Sites', 'raw_data:metadata.zonza_site'],
+            ['Category', 'raw_data:metadata.trials_category'],
+            ['Shapes', 'count:shape'],
+            ['Total Size', 'sum:shape__size'],
+        ],
+    },
+}
 
 AZURE_STORAGE = {
     'ACCOUNT_NAME': os.environ.get('APPSETTING_STORAGE_ACCOUNT_NAME'),